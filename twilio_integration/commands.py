@@ -0,0 +1,18 @@
+import click
+from frappe.commands import pass_context, get_site
+
+
+@click.command("whatsapp-dispatcher")
+@click.option("--poll-timeout", default=5, type=int, help="Seconds to wait for new messages before reconnecting")
+@pass_context
+def whatsapp_dispatcher(context, poll_timeout=5):
+	"""Start the long running worker that sends WhatsApp messages as soon as they are queued"""
+	from twilio_integration.twilio_integration.whatsapp_dispatcher import run_dispatcher_worker
+
+	site = get_site(context)
+	run_dispatcher_worker(site, poll_timeout=poll_timeout)
+
+
+commands = [
+	whatsapp_dispatcher,
+]
@@ -65,12 +65,19 @@ fixtures = [
 scheduler_events = {
 	"all": [
 		"twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message.flush_outgoing_message_queue",
+		"twilio_integration.twilio_integration.doctype.whatsapp_campaign.whatsapp_campaign.update_whatsapp_campaigns",
+		"twilio_integration.twilio_integration.webhook_inbox.process_webhook_inbox",
+		"twilio_integration.twilio_integration.status_buffer.flush_status_buffer",
+		"twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message.enqueue_incoming_media_download",
 	],
-	"hourly_long": [
-		"twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message.update_messages_pending_status_reconciliation",
-		"twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message.flush_incoming_media_queue",
-	],
+	"cron": {
+		"*/5 * * * *": [
+			"twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message.enqueue_status_reconciliation",
+		],
+	},
 	"daily": [
 		"twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message.expire_whatsapp_message_queue",
+		"twilio_integration.twilio_integration.webhook_inbox.clear_processed_webhook_requests",
+		"twilio_integration.twilio_integration.pdf_cache.clear_expired_pdf_cache",
 	],
 }
@@ -1,8 +1,49 @@
 import frappe
-from collections import Counter
+from frappe.utils import cint
 from frappe.core.doctype.communication.communication import Communication
 
 
+# WhatsApp Message statuses grouped by their effect on the Delivery Status of the Communication
+whatsapp_status_groups = {
+	"Not Sent": "Sending",
+	"Sending": "Sending",
+	"Queued": "Sending",
+	"Undelivered": "Error",
+	"Error": "Error",
+	"Failed": "Error",
+	"Sent": "Sent",
+	"Delivered": "Sent",
+	"Read": "Read",
+}
+
+status_counts_expiry = 60 * 60
+
+# Apply a status change to the counters only if they have already been built from the table, counts never go below 0
+increment_status_count_script = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+	return 0
+end
+
+if ARGV[1] ~= '' and tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0') > 0 then
+	redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+end
+if ARGV[2] ~= '' then
+	redis.call('HINCRBY', KEYS[1], ARGV[2], 1)
+end
+
+return 1
+"""
+
+set_status_counts_script = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+	redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+	redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+
+return redis.call('HGETALL', KEYS[1])
+"""
+
+
 class CommunicationTwilio(Communication):
 	def set_delivery_status(self, commit=False):
 		"""Look into the status of WhatsApp Queue linked to this Communication and set the Delivery Status of this Communication"""
@@ -13,28 +54,91 @@ class CommunicationTwilio(Communication):
 		if self.sent_or_received == "Received":
 			return
 
-		status_counts = Counter(frappe.db.sql_list('''select status from `tabWhatsApp Message` where communication=%s''', self.name))
+		status_counts = get_whatsapp_status_counts(self.name)
 
 		delivery_status = None
 		read_by_recipient = 0
 
-		if status_counts.get("Queued") or status_counts.get("Not Sent") or status_counts.get("Sending"):
+		if status_counts.get("Sending"):
 			delivery_status = "Sending"
-		elif status_counts.get("Undelivered") or status_counts.get("Error") or status_counts.get("Failed"):
+		elif status_counts.get("Error"):
 			delivery_status = "Error"
-		elif status_counts.get("Sent") or status_counts.get("Delivered"):
+		elif status_counts.get("Sent"):
 			delivery_status = "Sent"
 		elif status_counts.get("Read"):
 			delivery_status = "Read"
 			read_by_recipient = 1
 
-		if delivery_status:
-			self.db_set({
-				"delivery_status": delivery_status,
-				"read_by_recipient": read_by_recipient,
-			})
-			self.notify_change("update")
-			self.notify_update()
+		if not delivery_status:
+			return
+
+		if delivery_status == self.delivery_status and read_by_recipient == cint(self.read_by_recipient):
+			return
+
+		self.db_set({
+			"delivery_status": delivery_status,
+			"read_by_recipient": read_by_recipient,
+		})
+		self.notify_change("update")
+		self.notify_update()
+
+		if commit:
+			frappe.db.commit()
+
+
+def get_whatsapp_status_counts(communication):
+	"""Get count of WhatsApp Messages of the Communication by status group.
+	Counters are kept in Redis and are only built from the table if they do not exist.
+	"""
+	key = get_status_counts_key(communication)
+
+	status_counts = frappe.cache().eval("return redis.call('HGETALL', KEYS[1])", 1, key)
+	if status_counts:
+		return parse_status_counts(status_counts)
+
+	counts_by_group = {}
+	for status, count in frappe.db.sql("""
+		select status, count(*)
+		from `tabWhatsApp Message`
+		where communication = %s
+		group by status
+	""", communication):
+		group = whatsapp_status_groups.get(status)
+		if group:
+			counts_by_group[group] = counts_by_group.get(group, 0) + count
+
+	args = [status_counts_expiry, "_", 0]  # "_" marks that the counters exist even if there are no messages
+	for group, count in counts_by_group.items():
+		args += [group, count]
+
+	status_counts = frappe.cache().eval(set_status_counts_script, 1, key, *args)
+	return parse_status_counts(status_counts)
+
+
+def record_whatsapp_status_change(communication, previous_status, status):
+	"""Apply the status change of a WhatsApp Message to the status counters of its Communication"""
+	if not communication:
+		return
+
+	previous_group = whatsapp_status_groups.get(previous_status) or ""
+	group = whatsapp_status_groups.get(status) or ""
+	if previous_group == group:
+		return
+
+	frappe.cache().eval(increment_status_count_script, 1, get_status_counts_key(communication), previous_group, group)
+
+
+def clear_whatsapp_status_counts(communications):
+	"""Rebuild status counters from the table on next use, for bulk updates that do not record status changes"""
+	keys = [get_status_counts_key(communication) for communication in communications if communication]
+	if keys:
+		frappe.cache().delete(*keys)
+
+
+def parse_status_counts(status_counts):
+	status_counts = [frappe.safe_decode(d) for d in status_counts]
+	return {group: cint(count) for group, count in zip(status_counts[0::2], status_counts[1::2])}
+
 
-			if commit:
-				frappe.db.commit()
+def get_status_counts_key(communication):
+	return frappe.cache().make_key(f"whatsapp_status_counts:{communication}")
@@ -0,0 +1,25 @@
+import frappe
+
+
+# Defaults of WhatsApp Settings fields added after the DocType was created.
+# Defaults of new fields of a Single DocType are not set on existing sites by migrate.
+whatsapp_settings_defaults = {
+	"circuit_breaker_failure_threshold": 5,
+	"circuit_breaker_reset_timeout": 60,
+	"max_incoming_media_size": 25,
+	"media_download_concurrency": 4,
+	"media_download_connections_per_host": 4,
+	"pdf_cache_max_size": 500,
+	"pdf_cache_ttl": 24,
+}
+
+
+def execute():
+	for fieldname, value in whatsapp_settings_defaults.items():
+		is_set = frappe.db.sql("""
+			select 1 from `tabSingles`
+			where doctype = 'WhatsApp Settings' and field = %s and ifnull(value, '') != ''
+		""", fieldname)
+
+		if not is_set:
+			frappe.db.set_single_value("WhatsApp Settings", fieldname, value)
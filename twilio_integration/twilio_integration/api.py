@@ -2,13 +2,16 @@ from werkzeug.wrappers import Response
 
 import frappe
 from frappe import _
-from frappe.utils import cstr
 from frappe.contacts.doctype.contact.contact import get_contact_with_phone_number
 from .twilio_handler import Twilio, IncomingCall, TwilioCallDetails, validate_twilio_request
+from .webhook_inbox import is_webhook_inbox_enabled, store_webhook_request
 from twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message import (
 	incoming_message_callback,
 	outgoing_message_status_callback,
 	serve_whatsapp_media,
+	get_incoming_context_message,
+	get_incoming_reply_message,
+	should_process_incoming_message_in_background,
 )
 from twilio.twiml.messaging_response import MessagingResponse
 
@@ -46,11 +49,6 @@ def generate_access_token():
 def voice(**kwargs):
 	"""This is a webhook called by twilio to get instructions when the voice call request comes to twilio server.
 	"""
-	def _get_caller_number(caller):
-		identity = caller.replace('client:', '').strip()
-		user = Twilio.emailid_from_identity(identity)
-		return frappe.db.get_value('Voice Call Settings', user, 'twilio_number')
-
 	args = frappe._dict(kwargs)
 	twilio = Twilio.connect()
 	if not twilio:
@@ -60,25 +58,47 @@ def voice(**kwargs):
 	assert args.ApplicationSid == twilio.application_sid
 
 	# Generate TwiML instructions to make a call
-	from_number = _get_caller_number(args.Caller)
+	from_number = get_caller_number(args.Caller)
 	resp = twilio.generate_twilio_dial_response(from_number, args.To)
 
-	call_details = TwilioCallDetails(args, call_from=from_number)
-	create_call_log(call_details)
+	if is_webhook_inbox_enabled():
+		store_webhook_request("Voice Call", kwargs)
+	else:
+		call_details = TwilioCallDetails(args, call_from=from_number)
+		create_call_log(call_details)
+
 	return Response(resp.to_xml(), mimetype='text/xml')
 
 
+def process_voice_call_webhook(args):
+	call_details = TwilioCallDetails(args, call_from=get_caller_number(args.Caller))
+	create_call_log(call_details)
+
+
+def get_caller_number(caller):
+	identity = caller.replace('client:', '').strip()
+	user = Twilio.emailid_from_identity(identity)
+	return frappe.db.get_value('Voice Call Settings', user, 'twilio_number')
+
+
 @frappe.whitelist(allow_guest=True)
 @validate_twilio_request
 def twilio_incoming_call_handler(**kwargs):
 	args = frappe._dict(kwargs)
-	call_details = TwilioCallDetails(args)
-	create_call_log(call_details)
+	if is_webhook_inbox_enabled():
+		store_webhook_request("Incoming Call", kwargs)
+	else:
+		process_incoming_call_webhook(args)
 
 	resp = IncomingCall(args.From, args.To).process()
 	return Response(resp.to_xml(), mimetype='text/xml')
 
 
+def process_incoming_call_webhook(args):
+	call_details = TwilioCallDetails(args)
+	create_call_log(call_details)
+
+
 @frappe.whitelist()
 def create_call_log(call_details: TwilioCallDetails):
 	call_log = frappe.get_doc({**call_details.to_dict(),
@@ -110,16 +130,23 @@ def update_call_log(call_sid, status=None):
 @frappe.whitelist(allow_guest=True)
 @validate_twilio_request
 def update_recording_info(**kwargs):
+	if is_webhook_inbox_enabled():
+		store_webhook_request("Recording Info", kwargs)
+		return
+
 	try:
-		args = frappe._dict(kwargs)
-		recording_url = args.RecordingUrl
-		call_sid = args.CallSid
-		update_call_log(call_sid)
-		frappe.db.set_value("Call Log", call_sid, "recording_url", recording_url)
+		process_recording_info_webhook(frappe._dict(kwargs))
 	except:
 		frappe.log_error(title=_("Failed to capture Twilio recording"))
 
 
+def process_recording_info_webhook(args):
+	recording_url = args.RecordingUrl
+	call_sid = args.CallSid
+	update_call_log(call_sid)
+	frappe.db.set_value("Call Log", call_sid, "recording_url", recording_url)
+
+
 @frappe.whitelist()
 def get_contact_details(phone):
 	"""Get information about existing contact in the system.
@@ -140,18 +167,24 @@ def incoming_whatsapp_message_handler(**kwargs):
 	"""This is a webhook called by Twilio when a WhatsApp message is received.
 	"""
 	args = frappe._dict(kwargs)
+	context_message_name = get_incoming_context_message(args)
 
-	response = incoming_message_callback(args)
+	# Acknowledge immediately, the reply is sent via the API once the message is processed
+	if should_process_incoming_message_in_background(context_message_name):
+		if is_webhook_inbox_enabled():
+			store_webhook_request("Incoming WhatsApp Message", kwargs)
+			return Response(MessagingResponse().to_xml(), mimetype='text/xml')
 
-	reply_message = None
-	if cstr(response.get("reply_message")).strip():
-		reply_message = response.get("reply_message")
+		frappe.enqueue(
+			"twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message.process_incoming_message",
+			message_args=args,
+			context_message_name=context_message_name,
+			queue="short",
+		)
+		return Response(MessagingResponse().to_xml(), mimetype='text/xml')
 
-	disable_default_reply = response.get("disable_default_reply")
-
-	# Default Auto Reply
-	if not reply_message and not disable_default_reply:
-		reply_message = frappe.db.get_single_value('WhatsApp Settings', 'reply_message')
+	response = incoming_message_callback(args, context_message_name=context_message_name)
+	reply_message = get_incoming_reply_message(response)
 
 	resp = MessagingResponse()
 	if reply_message:
@@ -165,8 +198,15 @@ def incoming_whatsapp_message_handler(**kwargs):
 def whatsapp_message_status_callback(**kwargs):
 	"""This is a webhook called by Twilio whenever sent WhatsApp message status is changed.
 	"""
+	if is_webhook_inbox_enabled():
+		store_webhook_request("WhatsApp Message Status", kwargs)
+		return
+
+	process_whatsapp_message_status_webhook(frappe._dict(kwargs))
+
+
+def process_whatsapp_message_status_webhook(args):
 	frappe.set_user("Administrator")
-	args = frappe._dict(kwargs)
 	outgoing_message_status_callback(args, auto_commit=True)
 
 
@@ -0,0 +1,109 @@
+import frappe
+from frappe.utils import cint
+from .utils import cache_key_exists
+
+
+# KEYS: failures, open, probe
+# ARGV: failure threshold, probe timeout
+allow_request_script = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+	return 0
+end
+
+local failures = tonumber(redis.call('GET', KEYS[1]) or '0')
+if failures < tonumber(ARGV[1]) then
+	return 1
+end
+
+-- Half open, let one probe through at a time
+if redis.call('SET', KEYS[3], '1', 'NX', 'EX', ARGV[2]) then
+	return 1
+end
+return 0
+"""
+
+# KEYS: failures, open, probe
+# ARGV: failure threshold, reset timeout
+record_failure_script = """
+local failures = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], 24 * 60 * 60)
+
+if failures >= tonumber(ARGV[1]) then
+	redis.call('SET', KEYS[2], '1', 'EX', ARGV[2])
+	redis.call('DEL', KEYS[3])
+end
+
+return failures
+"""
+
+# Error classes that mean the provider is unavailable, other errors still mean that it responded
+unavailable_error_classes = ("network", "provider_unavailable", "rate_limited")
+
+# Error classes raised before the provider is called, which say nothing about the provider
+local_error_classes = ("validation", "configuration")
+
+
+class CircuitBreaker:
+	"""Circuit breaker shared by all workers of the site through Redis.
+
+	Closed: calls are allowed until `failure_threshold` consecutive failures open the circuit.
+	Open: calls are rejected for `reset_timeout` seconds.
+	Half Open: one probe call is allowed at a time, success closes the circuit and failure opens it again.
+	"""
+	def __init__(self, name, failure_threshold=5, reset_timeout=60):
+		self.failures_key = frappe.cache().make_key(f"circuit_breaker:{name}:failures")
+		self.open_key = frappe.cache().make_key(f"circuit_breaker:{name}:open")
+		self.probe_key = frappe.cache().make_key(f"circuit_breaker:{name}:probe")
+		self.failure_threshold = cint(failure_threshold)
+		self.reset_timeout = max(cint(reset_timeout), 1)
+
+	@property
+	def keys(self):
+		return [self.failures_key, self.open_key, self.probe_key]
+
+	@property
+	def enabled(self):
+		return self.failure_threshold > 0
+
+	def allow_request(self):
+		if not self.enabled:
+			return True
+
+		return cint(frappe.cache().eval(allow_request_script, 3, *self.keys, self.failure_threshold, self.reset_timeout))
+
+	def is_open(self):
+		"""Check if calls are being rejected without taking the half open probe"""
+		return self.enabled and cache_key_exists(self.open_key)
+
+	def record_success(self):
+		if self.enabled:
+			frappe.cache().delete(*self.keys)
+
+	def record_failure(self):
+		if self.enabled:
+			frappe.cache().eval(record_failure_script, 3, *self.keys, self.failure_threshold, self.reset_timeout)
+
+
+def get_provider_circuit_breaker(whatsapp_provider):
+	return CircuitBreaker(
+		f"whatsapp:{whatsapp_provider}",
+		failure_threshold=frappe.get_cached_value("WhatsApp Settings", None, "circuit_breaker_failure_threshold"),
+		reset_timeout=frappe.get_cached_value("WhatsApp Settings", None, "circuit_breaker_reset_timeout"),
+	)
+
+
+def record_provider_call(whatsapp_provider, error=None):
+	"""Record the outcome of a call to the provider, `error` being the classified error if the call failed"""
+	circuit_breaker = get_provider_circuit_breaker(whatsapp_provider)
+	if error and error.error_class in unavailable_error_classes:
+		circuit_breaker.record_failure()
+	elif not error or error.error_class not in local_error_classes:
+		circuit_breaker.record_success()
+
+
+def get_available_providers():
+	"""WhatsApp providers whose circuit is not open"""
+	return [
+		whatsapp_provider for whatsapp_provider in ("Twilio", "Freshchat")
+		if not get_provider_circuit_breaker(whatsapp_provider).is_open()
+	]
@@ -3,7 +3,9 @@
 
 # import frappe
 from frappe.model.document import Document
+from ...freshchat_handler import clear_freshchat_client_pool
 
 
 class FreshchatSettings(Document):
-	pass
+	def on_update(self):
+		clear_freshchat_client_pool()
@@ -15,6 +15,7 @@ from random import randrange
 
 from twilio.rest import Client
 from ...utils import get_public_url
+from ...twilio_handler import clear_twilio_connection_pool
 
 class TwilioSettings(Document):
 	friendly_resource_name = "ERPNext" # System creates TwiML app & API keys with this name.
@@ -23,6 +24,8 @@ class TwilioSettings(Document):
 		self.validate_twilio_account()
 
 	def on_update(self):
+		clear_twilio_connection_pool()
+
 		# Single doctype records are created in DB at time of installation and those field values are set as null.
 		# This condition make sure that we handle null.
 		if not self.account_sid:
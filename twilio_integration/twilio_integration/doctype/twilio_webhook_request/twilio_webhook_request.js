@@ -0,0 +1,18 @@
+// Copyright (c) 2026, Frappe and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on('Twilio Webhook Request', {
+	refresh: function(frm) {
+		if (frm.doc.status == "Error" || frm.doc.status == "Processed") {
+			frm.add_custom_button(__("Replay"), () => {
+				frappe.call({
+					method: "twilio_integration.twilio_integration.webhook_inbox.replay_webhook_requests",
+					args: {
+						names: [frm.doc.name],
+					},
+					callback: () => frm.reload_doc(),
+				});
+			});
+		}
+	}
+});
@@ -0,0 +1,13 @@
+# Copyright (c) 2026, Frappe and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class TwilioWebhookRequest(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Twilio Webhook Request", ["status", "creation"], "index_status_creation")
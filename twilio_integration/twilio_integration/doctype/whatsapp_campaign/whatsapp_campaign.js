@@ -26,7 +26,7 @@ frappe.ui.form.on('WhatsApp Campaign', {
 			frm.disable_form();
 			frm.disable_save();
 		}
-		if(!frm.is_new() && frm.doc.status!='Completed') {
+		if(!frm.is_new() && !['Completed', 'In Progress'].includes(frm.doc.status)) {
 			frm.add_custom_button(('Send Now'), function(){
 				frappe.call({
 					doc: frm.doc,
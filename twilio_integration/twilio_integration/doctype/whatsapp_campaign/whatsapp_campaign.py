@@ -2,9 +2,13 @@
 # For license information, please see license.txt
 
 import frappe
+from frappe import _
 from frappe.model.document import Document
-from frappe.utils import get_site_url
-from twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message import WhatsAppMessage
+from frappe.utils import now_datetime, add_to_date, flt, cint
+import time
+from twilio_integration.twilio_integration.utils import cache_key_exists
+from twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message import WhatsAppMessage, \
+	are_whatsapp_messages_muted
 
 supported_file_ext = ['jpg',
 	'jpeg',
@@ -16,9 +20,19 @@ supported_file_ext = ['jpg',
 	'mp4'
 ]
 
+CAMPAIGN_CHUNK_SIZE = 500
+RECIPIENT_LOOKUP_CHUNK_SIZE = 1000
+RECIPIENT_NUMBER_CACHE_SECONDS = 60 * 60
+CAMPAIGN_LOCK_SECONDS = 10 * 60
+THROUGHPUT_WINDOW_MINUTES = 5
+
+sent_statuses = ('Queued', 'Sent', 'Delivered', 'Read')
+failed_statuses = ('Undelivered', 'Failed', 'Error', 'Expired')
+
+
 class WhatsAppCampaign(Document):
 	def validate(self):
-		if self.scheduled_time and self.status != 'Completed':
+		if self.scheduled_time and self.status not in ('Completed', 'In Progress'):
 			current_time = frappe.utils.now_datetime()
 			scheduled_time = frappe.utils.get_datetime(self.scheduled_time)
 
@@ -42,7 +56,7 @@ class WhatsAppCampaign(Document):
 				frappe.throw(_('Attachment format not supported.'))
 
 	def get_attachment(self):
-		file = frappe.db.get_value("File", {"attached_to_name": self.doctype, "attached_to_doctype": self.name, "is_private":0}, 'name')
+		file = frappe.db.get_value("File", {"attached_to_doctype": self.doctype, "attached_to_name": self.name, "is_private":0}, 'name')
 
 		if file:
 			return frappe.get_doc('File', file)
@@ -54,9 +68,18 @@ class WhatsAppCampaign(Document):
 		return contacts
 
 	def all_missing_recipients(self):
+		missing_recipients = {}
 		for recipient in self.recipients:
-			if not recipient.whatsapp_no:
-				recipient.whatsapp_no = frappe.db.get_value(recipient.campaign_for, recipient.recipient, 'whatsapp_no')
+			if not recipient.whatsapp_no and recipient.campaign_for and recipient.recipient:
+				missing_recipients.setdefault(recipient.campaign_for, set()).add(recipient.recipient)
+
+		whatsapp_numbers = {}
+		for doctype, names in missing_recipients.items():
+			whatsapp_numbers[doctype] = get_recipient_whatsapp_numbers(doctype, list(names))
+
+		for recipient in self.recipients:
+			if not recipient.whatsapp_no and recipient.campaign_for in whatsapp_numbers:
+				recipient.whatsapp_no = whatsapp_numbers[recipient.campaign_for].get(recipient.recipient)
 
 		self.total_participants = len(self.recipients)
 
@@ -74,20 +97,240 @@ class WhatsAppCampaign(Document):
 
 	@frappe.whitelist()
 	def send_now(self):
+		if self.status in ('In Progress', 'Completed'):
+			frappe.throw(_("Campaign is already {0}").format(self.status))
+
 		self.validate_attachment()
+		self.start()
+		frappe.msgprint(_("Campaign messages are being queued in the background"))
+
+	def start(self):
+		self.db_set({
+			'status': 'In Progress',
+			'started_at': now_datetime(),
+			'processed_recipients': 0,
+			'sent_count': 0,
+			'failed_count': 0,
+			'throughput': 0,
+			'eta': None,
+			'communication': None,
+		})
+		enqueue_whatsapp_campaign(self.name)
+
+	def execute(self):
+		"""Queue messages for recipients in chunks, checkpointing the last queued recipient row with each chunk.
+		Can be called again after an interruption to continue after the checkpoint.
+		"""
 		media = self.get_attachment()
-		self.db_set('status', 'In Progress')
-		if media:
-			media = get_site_url(frappe.local.site) + media.file_url
+		attachment = {"fid": media.name} if media else None
+
+		# All chunks are sent as a single Communication of the campaign
+		if not self.communication:
+			communication = WhatsAppMessage.create_outgoing_communication(
+				receiver_list=self.get_whatsapp_contact(),
+				message=self.message,
+				reference_doctype=self.doctype,
+				reference_name=self.name,
+				attachment=attachment,
+			)
+			self.db_set('communication', communication)
+			frappe.db.commit()
+
+		while True:
+			# Stop without moving the checkpoint, the campaign is resumed by the scheduler
+			if are_whatsapp_messages_muted():
+				return
+
+			recipients = frappe.db.sql("""
+				select idx, whatsapp_no
+				from `tabWhatsApp Campaign Recipient`
+				where parenttype = %s and parent = %s and idx > %s
+				order by idx
+				limit %s
+			""", (self.doctype, self.name, cint(self.processed_recipients), CAMPAIGN_CHUNK_SIZE), as_dict=True)
+
+			if not recipients:
+				break
+
+			receiver_list = [d.whatsapp_no for d in recipients if d.whatsapp_no]
+			if receiver_list:
+				WhatsAppMessage.send_whatsapp_message(
+					receiver_list=receiver_list,
+					message=self.message,
+					reference_doctype=self.doctype,
+					reference_name=self.name,
+					attachment=attachment,
+					bulk=True,
+					communication=self.communication,
+				)
+
+			# Messages of the chunk and the checkpoint are committed together
+			self.db_set('processed_recipients', recipients[-1].idx)
+			frappe.db.commit()
+
+			refresh_campaign_lock(self.name)
+
+		self.update_progress()
+
+	def update_progress(self):
+		"""Update sent and failed counts, throughput and estimated completion. Mark as Completed when all are processed."""
+		status_counts = dict(frappe.db.sql("""
+			select status, count(*)
+			from `tabWhatsApp Message`
+			where reference_doctype = %s and reference_name = %s and sent_received = 'Sent'
+			group by status
+		""", (self.doctype, self.name)))
+
+		total_messages = sum(status_counts.values())
+		sent_count = sum(status_counts.get(status, 0) for status in sent_statuses)
+		failed_count = sum(status_counts.get(status, 0) for status in failed_statuses)
+
+		unprocessed_recipients = frappe.db.sql("""
+			select count(*)
+			from `tabWhatsApp Campaign Recipient`
+			where parenttype = %s and parent = %s and idx > %s and ifnull(whatsapp_no, '') != ''
+		""", (self.doctype, self.name, cint(self.processed_recipients)))[0][0]
+
+		pending = total_messages - sent_count - failed_count + unprocessed_recipients
+
+		window_start = add_to_date(now_datetime(), minutes=-THROUGHPUT_WINDOW_MINUTES)
+		recently_sent = frappe.db.sql("""
+			select count(*)
+			from `tabWhatsApp Message`
+			where reference_doctype = %s and reference_name = %s and sent_received = 'Sent' and date_sent >= %s
+		""", (self.doctype, self.name, window_start))[0][0]
+		throughput = flt(recently_sent / THROUGHPUT_WINDOW_MINUTES, 2)
+
+		eta = None
+		if pending and throughput:
+			eta = add_to_date(now_datetime(), minutes=pending / throughput)
+
+		values = {
+			'sent_count': sent_count,
+			'failed_count': failed_count,
+			'throughput': throughput,
+			'eta': eta,
+		}
+		if not pending:
+			values['status'] = 'Completed'
+
+		self.db_set(values, notify=True)
+
+	def is_fully_processed(self):
+		last_idx = frappe.db.sql("""
+			select max(idx)
+			from `tabWhatsApp Campaign Recipient`
+			where parenttype = %s and parent = %s
+		""", (self.doctype, self.name))[0][0]
+
+		return cint(self.processed_recipients) >= cint(last_idx)
+
+
+def get_recipient_whatsapp_numbers(doctype, names):
+	"""Get WhatsApp numbers of recipients of a DocType with one query per chunk of names.
+	Resolved numbers are cached for a while so that they are not looked up again when the campaign is edited.
+	"""
+	key = frappe.cache().make_key(f"whatsapp_recipient_numbers:{doctype}")
+	whatsapp_numbers = {}
+	now = time.time()
+
+	for i in range(0, len(names), RECIPIENT_LOOKUP_CHUNK_SIZE):
+		chunk = names[i:i + RECIPIENT_LOOKUP_CHUNK_SIZE]
+
+		cached_numbers = frappe.cache().eval("return redis.call('HMGET', KEYS[1], unpack(ARGV))", 1, key, *chunk)
+		uncached_names = []
+		for name, cached_number in zip(chunk, cached_numbers):
+			# Each entry is stored as "<expiry timestamp>|<number>"
+			expires_at, whatsapp_no = frappe.safe_decode(cached_number or "0|").split("|", 1)
+			if flt(expires_at) > now and whatsapp_no:
+				whatsapp_numbers[name] = whatsapp_no
+			else:
+				uncached_names.append(name)
+
+		if not uncached_names:
+			continue
+
+		resolved_numbers = dict(frappe.get_all(
+			doctype,
+			filters={"name": ["in", uncached_names]},
+			fields=["name", "whatsapp_no"],
+			as_list=True,
+		))
+
+		# Missing numbers are not cached, so that numbers added later are found
+		args = [RECIPIENT_NUMBER_CACHE_SECONDS]
+		for name in uncached_names:
+			whatsapp_no = resolved_numbers.get(name)
+			if whatsapp_no:
+				whatsapp_numbers[name] = whatsapp_no
+				args += [name, f"{now + RECIPIENT_NUMBER_CACHE_SECONDS}|{whatsapp_no}"]
+
+		if len(args) > 1:
+			frappe.cache().eval("""
+				redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+				redis.call('EXPIRE', KEYS[1], ARGV[1])
+			""", 1, key, *args)
+
+	return whatsapp_numbers
+
+
+def enqueue_whatsapp_campaign(campaign):
+	frappe.enqueue(
+		"twilio_integration.twilio_integration.doctype.whatsapp_campaign.whatsapp_campaign.execute_whatsapp_campaign",
+		campaign=campaign,
+		queue="long",
+		enqueue_after_commit=True,
+	)
+
+
+def execute_whatsapp_campaign(campaign):
+	if not acquire_campaign_lock(campaign):
+		return
+
+	try:
+		doc = frappe.get_doc("WhatsApp Campaign", campaign)
+		if doc.status == 'In Progress':
+			doc.execute()
+			frappe.db.commit()
+	finally:
+		release_campaign_lock(campaign)
+
+
+def update_whatsapp_campaigns():
+	"""Start due scheduled campaigns, resume interrupted campaigns and update progress. Called from scheduler"""
+	for campaign in frappe.get_all("WhatsApp Campaign", filters={
+		"status": "Scheduled",
+		"scheduled_time": ["<=", now_datetime()],
+	}, pluck="name"):
+		frappe.get_doc("WhatsApp Campaign", campaign).start()
+
+	for campaign in frappe.get_all("WhatsApp Campaign", filters={"status": "In Progress"}, pluck="name"):
+		doc = frappe.get_doc("WhatsApp Campaign", campaign)
+
+		# The executor keeps the lock while queuing, so a campaign without lock was interrupted
+		if not doc.is_fully_processed() and not is_campaign_locked(campaign):
+			enqueue_whatsapp_campaign(campaign)
+
+		doc.update_progress()
+
+	frappe.db.commit()
+
+
+def acquire_campaign_lock(campaign):
+	return frappe.cache().set(get_campaign_lock_key(campaign), frappe.local.site, nx=True, ex=CAMPAIGN_LOCK_SECONDS)
+
+
+def refresh_campaign_lock(campaign):
+	frappe.cache().expire(get_campaign_lock_key(campaign), CAMPAIGN_LOCK_SECONDS)
+
+
+def release_campaign_lock(campaign):
+	frappe.cache().delete(get_campaign_lock_key(campaign))
 
-		WhatsAppMessage.send_whatsapp_message(
-			receiver_list = self.get_whatsapp_contact(),
-			message = self.message,
-			reference_doctype= self.doctype,
-			reference_name= self.name,
-			media = media
-		)
 
-		self.db_set('status', 'Completed')
+def is_campaign_locked(campaign):
+	return cache_key_exists(get_campaign_lock_key(campaign))
 
 
+def get_campaign_lock_key(campaign):
+	return frappe.cache().make_key(f"whatsapp_campaign_lock:{campaign}")
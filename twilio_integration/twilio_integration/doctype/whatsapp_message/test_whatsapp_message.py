@@ -1,8 +1,202 @@
 # Copyright (c) 2021, Frappe and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 import unittest
+from frappe.utils import add_to_date, now_datetime
+
+from twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message import (
+	MessageStatusWriteBack,
+	apply_status_updates,
+	claim_incoming_media_messages,
+	claim_outgoing_messages,
+	get_reconciliation_windows,
+	recover_expired_message_leases,
+	renew_message_lease,
+	update_message_status_if_newer,
+)
+from twilio_integration.overrides.communication_hooks import (
+	clear_whatsapp_status_counts,
+	get_whatsapp_status_counts,
+	record_whatsapp_status_change,
+)
+
 
 class TestWhatsAppMessage(unittest.TestCase):
-	pass
+	def tearDown(self):
+		frappe.db.rollback()
+		frappe.db.delete("WhatsApp Message", {"from_": TEST_SENDER})
+		frappe.db.commit()
+
+	def test_status_moves_forward(self):
+		message = make_test_message("Queued")
+
+		self.assertEqual(update_message_status_if_newer(message.name, "Delivered"), "Queued")
+		self.assertEqual(frappe.db.get_value("WhatsApp Message", message.name, "status"), "Delivered")
+
+	def test_stale_and_duplicate_statuses_are_dropped(self):
+		message = make_test_message("Read")
+
+		self.assertIsNone(update_message_status_if_newer(message.name, "Sent"))
+		self.assertIsNone(update_message_status_if_newer(message.name, "Read"))
+		self.assertEqual(frappe.db.get_value("WhatsApp Message", message.name, "status"), "Read")
+
+	def test_final_status_is_not_overwritten(self):
+		message = make_test_message("Error")
+
+		self.assertIsNone(update_message_status_if_newer(message.name, "Delivered"))
+		self.assertEqual(frappe.db.get_value("WhatsApp Message", message.name, "status"), "Error")
+
+	def test_out_of_order_status_updates(self):
+		message = make_test_message("Queued")
+
+		apply_status_updates([
+			frappe._dict(id=message.id, from_=message.from_, to=message.to, status="Read"),
+			frappe._dict(id=message.id, from_=message.from_, to=message.to, status="Sent"),
+		])
+
+		self.assertEqual(frappe.db.get_value("WhatsApp Message", message.name, "status"), "Read")
+
+	def test_status_count_transitions(self):
+		communication = f"test-{frappe.generate_hash(length=8)}"
+		clear_whatsapp_status_counts([communication])
+		get_whatsapp_status_counts(communication)
+
+		record_whatsapp_status_change(communication, None, "Queued")
+		record_whatsapp_status_change(communication, None, "Queued")
+		self.assertEqual(get_whatsapp_status_counts(communication).get("Sending"), 2)
+
+		record_whatsapp_status_change(communication, "Queued", "Delivered")
+		status_counts = get_whatsapp_status_counts(communication)
+		self.assertEqual(status_counts.get("Sending"), 1)
+		self.assertEqual(status_counts.get("Sent"), 1)
+
+		# Transitions within the same group do not change the counts
+		record_whatsapp_status_change(communication, "Sent", "Delivered")
+		self.assertEqual(get_whatsapp_status_counts(communication).get("Sent"), 1)
+
+		clear_whatsapp_status_counts([communication])
+
+	def test_status_counts_do_not_go_below_zero(self):
+		communication = f"test-{frappe.generate_hash(length=8)}"
+		clear_whatsapp_status_counts([communication])
+		get_whatsapp_status_counts(communication)
+
+		record_whatsapp_status_change(communication, "Queued", "Read")
+		record_whatsapp_status_change(communication, "Queued", "Read")
+
+		status_counts = get_whatsapp_status_counts(communication)
+		self.assertFalse(status_counts.get("Sending"))
+		self.assertEqual(status_counts.get("Read"), 2)
+
+		clear_whatsapp_status_counts([communication])
+
+	def test_claim_outgoing_messages(self):
+		message = make_test_message("Not Sent")
+		frappe.db.commit()
+
+		claimed = claim_outgoing_messages(message_names=[message.name])
+		self.assertEqual([d.name for d in claimed], [message.name])
+		self.assertEqual(frappe.db.get_value("WhatsApp Message", message.name, "status"), "Sending")
+
+		# A claimed message is not claimed again
+		self.assertFalse(claim_outgoing_messages(message_names=[message.name]))
+
+	def test_expired_lease_is_recovered(self):
+		message = make_test_message("Not Sent")
+		frappe.db.commit()
+
+		lease_owner = claim_outgoing_messages(message_names=[message.name])[0].lease_owner
+		frappe.db.set_value("WhatsApp Message", message.name, "lease_expires_at", add_to_date(now_datetime(), seconds=-1))
+		frappe.db.commit()
+
+		recover_expired_message_leases()
+		self.assertEqual(frappe.db.get_value("WhatsApp Message", message.name, "status"), "Not Sent")
+
+		# The previous owner has lost the message and cannot renew its lease
+		self.assertFalse(renew_message_lease(message.name, lease_owner))
+
+		reclaimed = claim_outgoing_messages(message_names=[message.name])
+		self.assertNotEqual(reclaimed[0].lease_owner, lease_owner)
+		self.assertTrue(renew_message_lease(message.name, reclaimed[0].lease_owner))
+
+	def test_send_results_are_written_in_bulk(self):
+		messages = [make_test_message("Not Sent") for i in range(3)]
+		frappe.db.commit()
+
+		claimed = claim_outgoing_messages(message_names=[d.name for d in messages])
+		lease_owner = claimed[0].lease_owner
+
+		# The last message is recovered by another worker before the results are written
+		recover_message = messages[2]
+		frappe.db.set_value("WhatsApp Message", recover_message.name, "lease_owner", "another worker")
+		frappe.db.commit()
+
+		write_back = MessageStatusWriteBack()
+		write_back.add(messages[0], lease_owner, {"id": "SM-first", "status": "Queued", "lease_owner": None})
+		write_back.add(messages[1], lease_owner, {"status": "Not Sent", "retry": 1, "error": "Timeout", "lease_owner": None})
+		write_back.add(recover_message, lease_owner, {"id": "SM-stale", "status": "Queued", "lease_owner": None})
+		write_back.flush()
+
+		self.assertEqual(
+			frappe.db.get_value("WhatsApp Message", messages[0].name, ["id", "status", "lease_owner"]),
+			("SM-first", "Queued", None),
+		)
+		self.assertEqual(
+			frappe.db.get_value("WhatsApp Message", messages[1].name, ["status", "retry", "error"]),
+			("Not Sent", 1, "Timeout"),
+		)
+		self.assertEqual(
+			frappe.db.get_value("WhatsApp Message", recover_message.name, ["id", "status"]),
+			(recover_message.id, "Sending"),
+		)
+
+	def test_claim_incoming_media_messages(self):
+		message = make_test_message("Received", sent_received="Received", incoming_media_status="To Download")
+		frappe.db.commit()
+
+		claimed = claim_incoming_media_messages(message_names=[message.name])
+		self.assertEqual([d.name for d in claimed], [message.name])
+		self.assertEqual(frappe.db.get_value("WhatsApp Message", message.name, "incoming_media_status"), "Downloading")
+		self.assertFalse(claim_incoming_media_messages(message_names=[message.name]))
+
+		# An interrupted download is claimed again once its lease expires and counts as a failed attempt
+		frappe.db.set_value("WhatsApp Message", message.name, "lease_expires_at", add_to_date(now_datetime(), seconds=-1))
+		frappe.db.commit()
+
+		reclaimed = claim_incoming_media_messages(message_names=[message.name])
+		self.assertNotEqual(reclaimed[0].lease_owner, claimed[0].lease_owner)
+		self.assertEqual(frappe.db.get_value("WhatsApp Message", message.name, "retry"), 1)
+
+	def test_reconciliation_windows_are_split_by_gaps(self):
+		now = now_datetime()
+		messages = [
+			frappe._dict(name="a", date_sent=add_to_date(now, days=-2)),
+			frappe._dict(name="b", date_sent=add_to_date(now, minutes=-30)),
+			frappe._dict(name="c", date_sent=now),
+		]
+
+		windows = get_reconciliation_windows(messages)
+
+		self.assertEqual([[d.name for d in bucket] for _, _, bucket in windows], [["a"], ["b", "c"]])
+		self.assertEqual(windows[0][0], add_to_date(now, days=-2, hours=-1))
+		self.assertEqual(windows[0][1], add_to_date(now, days=-2, hours=1))
+		self.assertEqual(windows[1][1], add_to_date(now, hours=1))
+
+
+TEST_SENDER = "whatsapp:+10000000000"
+
+
+def make_test_message(status, **kwargs):
+	message = frappe.get_doc({
+		"doctype": "WhatsApp Message",
+		"sent_received": "Sent",
+		"whatsapp_provider": "Twilio",
+		"status": status,
+		"id": f"SM{frappe.generate_hash(length=32)}",
+		"from_": TEST_SENDER,
+		"to": "whatsapp:+10000000001",
+		**kwargs,
+	})
+	message.insert(ignore_permissions=True)
+	return message
@@ -5,13 +5,32 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 from frappe.utils.password import get_decrypted_password
-from frappe.utils import get_site_url, convert_utc_to_system_timezone, time_diff, now_datetime, cint
+from frappe.utils import (
+	get_site_url, convert_utc_to_system_timezone, time_diff, now_datetime, cint, cstr, add_to_date,
+	get_datetime, get_system_timezone,
+)
 from frappe.utils.verified_command import get_signed_params, verify_request
 from ...twilio_handler import Twilio
-from urllib.parse import quote, urlparse, urljoin
-from datetime import timedelta
+from ...freshchat_handler import get_freshchat_client
+from ...utils import cache_key_exists, map_in_site_threads
+from ...rate_limiter import acquire_send_token, get_send_rate_limit
+from ...provider_errors import classify_provider_error, record_provider_error, WhatsAppConfigurationError
+from ...circuit_breaker import get_provider_circuit_breaker, record_provider_call, get_available_providers
+from ...whatsapp_dispatcher import is_dispatcher_worker_enabled, push_to_dispatch_queue
+from ...media_storage import (
+	MEDIA_CHUNK_SIZE, MediaTooLargeError, store_media_stream, store_media_content, make_media_file, raise_media_too_large,
+)
+from ...pdf_cache import is_pdf_cache_enabled, get_cached_print_pdf, get_print_pdf_file_name
+from ...status_buffer import get_status_update_coalescing_window, buffer_status_update
+from twilio_integration.overrides.communication_hooks import record_whatsapp_status_change, clear_whatsapp_status_counts
+from urllib.parse import quote, urlparse
+from datetime import timedelta, timezone
+from zoneinfo import ZoneInfo
 import json
-import requests
+import os
+import random
+import socket
+import time
 
 
 class WhatsAppMessage(Document):
@@ -52,10 +71,14 @@ class WhatsAppMessage(Document):
 
 		fid = frappe.db.get_value("File", file_data)
 		if not fid:
-			file = frappe.new_doc("File", **file_data)
-			file.content = print_format_file["fcontent"]
-			file.insert(ignore_permissions=True)
-			fid = file.name
+			_, extension = os.path.splitext(print_format_file["fname"])
+			stored_media = store_media_content(print_format_file["fcontent"], extension)
+			fid = make_media_file(
+				stored_media,
+				file_name=file_data.file_name,
+				attached_to_doctype=file_data.attached_to_doctype,
+				attached_to_name=file_data.attached_to_name,
+			).name
 
 		# not needed becuase twilio downloads the file before sending message and callback
 		# if self.communication:
@@ -93,7 +116,15 @@ class WhatsAppMessage(Document):
 		automated=False,
 		delayed=False,
 		now=False,
+		bulk=None,
+		communication=None,
 	):
+		"""Queue WhatsApp Messages for the list of receivers.
+		In bulk mode, messages are inserted with a multi-row insert and one send job is enqueued per chunk of messages.
+		Bulk mode is used by default for large receiver lists.
+		If the dispatcher worker is enabled, messages are pushed to its queue instead of enqueuing jobs.
+		If `communication` is provided, messages are linked to it instead of creating a new Communication.
+		"""
 		from frappe.email.doctype.notification.notification import get_doc_for_notification_triggers
 
 		if are_whatsapp_messages_muted(whatsapp_provider):
@@ -105,7 +136,7 @@ class WhatsAppMessage(Document):
 			if not isinstance(receiver_list, list):
 				receiver_list = [receiver_list]
 
-		communication = cls.create_outgoing_communication(
+		communication = communication or cls.create_outgoing_communication(
 			receiver_list=receiver_list,
 			message=message,
 			reference_doctype=reference_doctype,
@@ -119,6 +150,38 @@ class WhatsAppMessage(Document):
 		doc = get_doc_for_notification_triggers(reference_doctype, reference_name)
 		run_before_send_method(doc=doc, notification_type=notification_type)
 
+		if bulk is None:
+			bulk = len(receiver_list) >= BULK_SEND_THRESHOLD
+		if bulk and not now:
+			message_names = cls.store_whatsapp_messages_in_bulk(
+				receiver_list=receiver_list,
+				message=message,
+				reference_doctype=reference_doctype,
+				reference_docname=reference_name,
+				child_doctype=child_doctype,
+				child_name=child_name,
+				party_doctype=party_doctype,
+				party=party,
+				communication=communication,
+				attachment=attachment,
+				whatsapp_message_template=whatsapp_message_template,
+				whatsapp_reply_handler=whatsapp_reply_handler,
+				whatsapp_provider=whatsapp_provider,
+				content_variables=content_variables,
+				notification_type=notification_type,
+			)
+
+			if not delayed and is_dispatcher_worker_enabled():
+				push_to_dispatch_queue(message_names)
+			elif not delayed:
+				for i in range(0, len(message_names), BULK_SEND_CHUNK_SIZE):
+					frappe.enqueue(
+						"twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message.send_whatsapp_messages",
+						message_names=message_names[i:i + BULK_SEND_CHUNK_SIZE],
+						enqueue_after_commit=True
+					)
+			return
+
 		for rec in receiver_list:
 			wa_msg = cls.store_whatsapp_message(
 				to=rec,
@@ -141,6 +204,8 @@ class WhatsAppMessage(Document):
 			if not delayed:
 				if now:
 					send_whatsapp_message(wa_msg.name, auto_commit=not now, now=now)
+				elif is_dispatcher_worker_enabled():
+					push_to_dispatch_queue([wa_msg.name])
 				else:
 					frappe.enqueue(
 						"twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message.send_whatsapp_message",
@@ -271,13 +336,7 @@ class WhatsAppMessage(Document):
 		content_variables=None,
 		notification_type=None,
 	):
-		sender = frappe.db.get_single_value('WhatsApp Settings', 'whatsapp_no')
-		if not sender:
-			frappe.throw(_("Please configure WhatsApp Number"))
-
-		whatsapp_provider = whatsapp_provider or frappe.db.get_single_value('WhatsApp Settings', 'whatsapp_provider')
-		if not whatsapp_provider:
-			frappe.throw(_("Please configure WhatsApp Provider"))
+		sender, whatsapp_provider = cls.get_sender_and_provider(whatsapp_provider)
 
 		template = frappe.get_cached_doc("WhatsApp Message Template", whatsapp_message_template) if whatsapp_message_template else frappe._dict()
 		reply_handler = template.reply_handler if template else whatsapp_reply_handler
@@ -304,11 +363,111 @@ class WhatsAppMessage(Document):
 			'retry': 0,
 		})
 		wa_msg.insert(ignore_permissions=True)
+		record_whatsapp_status_change(communication, None, wa_msg.status)
+
+		media_url, content_variables = cls.get_media_url_and_content_variables(
+			wa_msg.name, template, whatsapp_provider, content_variables
+		)
+
+		if content_variables:
+			wa_msg.db_set({
+				"content_variables": json.dumps(content_variables, sort_keys=False) if content_variables else None,
+				"media_url": media_url,
+			})
+
+		return wa_msg
+
+	@classmethod
+	def store_whatsapp_messages_in_bulk(
+		cls,
+		receiver_list,
+		message=None,
+		reference_doctype=None,
+		reference_docname=None,
+		child_doctype=None,
+		child_name=None,
+		party_doctype=None,
+		party=None,
+		communication=None,
+		attachment=None,
+		whatsapp_message_template=None,
+		whatsapp_reply_handler=None,
+		whatsapp_provider=None,
+		content_variables=None,
+		notification_type=None,
+	):
+		"""Insert outgoing WhatsApp Messages for all receivers with a multi-row insert and return their names"""
+		sender, whatsapp_provider = cls.get_sender_and_provider(whatsapp_provider)
+
+		template = frappe.get_cached_doc("WhatsApp Message Template", whatsapp_message_template) if whatsapp_message_template else frappe._dict()
+		reply_handler = template.reply_handler if template else whatsapp_reply_handler
 
-		# Media URL and Content Variables
+		now = now_datetime()
+		common_values = {
+			'creation': now,
+			'modified': now,
+			'owner': frappe.session.user,
+			'modified_by': frappe.session.user,
+			'sent_received': 'Sent',
+			'from_': f'whatsapp:{sender}',
+			'message': message,
+			'reference_doctype': reference_doctype,
+			'reference_name': reference_docname,
+			'child_doctype': child_doctype,
+			'child_name': child_name,
+			'party_doctype': party_doctype,
+			'party': party,
+			'attachment': json.dumps(attachment) if attachment else None,
+			'communication': communication,
+			'notification_type': notification_type,
+			'template_sid': template.template_sid or None,
+			'reply_handler': reply_handler or None,
+			'whatsapp_provider': whatsapp_provider or None,
+			'status': 'Not Sent',
+			'retry': 0,
+		}
+
+		fields = ['name', 'to', 'content_variables', 'media_url'] + list(common_values)
+		values = []
+		message_names = []
+
+		for to in receiver_list:
+			name = frappe.generate_hash(length=10)
+			media_url, message_content_variables = cls.get_media_url_and_content_variables(
+				name, template, whatsapp_provider, content_variables
+			)
+
+			values.append([
+				name,
+				f'whatsapp:{to}',
+				json.dumps(message_content_variables, sort_keys=False) if message_content_variables else None,
+				media_url if message_content_variables else None,
+			] + list(common_values.values()))
+			message_names.append(name)
+
+		frappe.db.bulk_insert("WhatsApp Message", fields, values)
+
+		# Counters rebuilt before the insert is committed would miss these messages
+		frappe.db.after_commit.add(lambda: clear_whatsapp_status_counts([communication]))
+
+		return message_names
+
+	@classmethod
+	def get_sender_and_provider(cls, whatsapp_provider=None):
+		sender = frappe.db.get_single_value('WhatsApp Settings', 'whatsapp_no')
+		if not sender:
+			frappe.throw(_("Please configure WhatsApp Number"), exc=WhatsAppConfigurationError)
+
+		whatsapp_provider = whatsapp_provider or frappe.db.get_single_value('WhatsApp Settings', 'whatsapp_provider')
+		if not whatsapp_provider:
+			frappe.throw(_("Please configure WhatsApp Provider"), exc=WhatsAppConfigurationError)
+
+		return sender, whatsapp_provider
+
+	@classmethod
+	def get_media_url_and_content_variables(cls, message_name, template, whatsapp_provider, content_variables=None):
 		media_url = None
-		if not content_variables:
-			content_variables = {}
+		content_variables = (content_variables or {}).copy()
 
 		if template.media_variable:
 			# Media URL provided
@@ -320,20 +479,14 @@ class WhatsAppMessage(Document):
 			# Media URL to be generated
 			else:
 				if whatsapp_provider == "Twilio":
-					media_url = f"api/method/twilio.whatsapp_media?id={quote(wa_msg.name)}"
+					media_url = f"api/method/twilio.whatsapp_media?id={quote(message_name)}"
 					content_variables[template.media_variable] = media_url
 				else:
 					site_url = get_site_url(frappe.local.site)
-					params = get_signed_params({"id": wa_msg.name})
+					params = get_signed_params({"id": message_name})
 					media_url = f"{site_url}/api/method/whatsapp.secure_whatsapp_media.pdf?{params}"
 
-		if content_variables:
-			wa_msg.db_set({
-				"content_variables": json.dumps(content_variables, sort_keys=False) if content_variables else None,
-				"media_url": media_url,
-			})
-
-		return wa_msg
+		return media_url, content_variables
 
 	def send_whatsapp_via_twilio(self):
 		client = Twilio.get_twilio_client()
@@ -375,26 +528,17 @@ class WhatsAppMessage(Document):
 		return args
 
 	def send_whatsapp_via_freshchat(self):
-		freshchat_settings = frappe.get_single("Freshchat Settings")
+		freshchat = get_freshchat_client()
 
-		api_key = freshchat_settings.api_key
-		api_endpoint = urljoin(freshchat_settings.api_endpoint, "/v2/outbound-messages/whatsapp")
-		channel_id = freshchat_settings.channel_id
-		namespace = freshchat_settings.namespace
 		from_ = self.from_.replace("whatsapp:", "")
 		to = self.to.replace("whatsapp:", "")
 
-		headers = {
-			"Authorization": f"Bearer {api_key}",
-			"Content-Type": "application/json"
-		}
-
 		message_data = {
 			"message_type": "template",
 			"message_template": {
 				"storage": "conversation",
 				"template_name": self.template_sid,
-				"namespace": namespace,
+				"namespace": freshchat.namespace,
 				"language": {
 					"policy": "deterministic",
 					"code": "en_US"  # TODO set language
@@ -426,17 +570,14 @@ class WhatsAppMessage(Document):
 			message_data["message_template"]["rich_template_data"] = rich_template_data
 
 		payload = {
-			"channel_id": channel_id,
+			"channel_id": freshchat.channel_id,
 			"from": {"phone_number": from_},
 			"to": [{"phone_number": to}],
 			"provider": "whatsapp",
 			"data": message_data,
 		}
 
-		response = requests.post(api_endpoint, headers=headers, json=payload)
-		response.raise_for_status()
-
-		response_data = response.json()
+		response_data = freshchat.send_outbound_message(payload)
 
 		out = frappe._dict({
 			"id": response_data.get("request_id"),
@@ -505,28 +646,43 @@ class WhatsAppMessage(Document):
 		if self.status not in ('Sent', 'Queued'):
 			return
 
-		previous_status = self.status
 		message_status = self.get_message_status()
 
-		if not message_status.status or (message_status.status == previous_status):
+		if not message_status.status:
 			return
 
-		self.db_set({
-			"status": message_status.status,
-			"error": message_status.error,
-		})
+		previous_status = update_message_status_if_newer(self.name, message_status.status, error=message_status.error)
+		if not previous_status:
+			return
+
+		self.status = message_status.status
+		self.error = message_status.error
 
 		if self.communication:
+			record_whatsapp_status_change(self.communication, previous_status, message_status.status)
 			frappe.get_doc('Communication', self.communication).set_delivery_status(commit=False)
 
 	def get_message_status(self):
 		if self.whatsapp_provider == "Twilio":
-			return self.get_message_status_from_twilio()
+			get_provider_message_status = self.get_message_status_from_twilio
 		elif self.whatsapp_provider == "Freshchat":
-			return self.get_message_status_from_freshchat()
+			get_provider_message_status = self.get_message_status_from_freshchat
 		else:
 			return frappe._dict()
 
+		# Do not wait on a provider that is down
+		if not get_provider_circuit_breaker(self.whatsapp_provider).allow_request():
+			return frappe._dict()
+
+		try:
+			message_status = get_provider_message_status()
+		except Exception as e:
+			record_provider_call(self.whatsapp_provider, classify_provider_error(e))
+			raise
+
+		record_provider_call(self.whatsapp_provider)
+		return message_status
+
 	def get_message_status_from_twilio(self):
 		out = frappe._dict({
 			"status": None,
@@ -535,7 +691,7 @@ class WhatsAppMessage(Document):
 		if not self.id:
 			return out
 
-		out.status = Twilio.get_message(self.id).status.title()
+		out.status = get_twilio_message_status(Twilio.get_message(self.id).status)
 		return out
 
 	def get_message_status_from_freshchat(self):
@@ -546,20 +702,7 @@ class WhatsAppMessage(Document):
 		if not self.id:
 			return out
 
-		freshchat_settings = frappe.get_single("Freshchat Settings")
-
-		api_key = freshchat_settings.api_key
-		api_endpoint = urljoin(freshchat_settings.api_endpoint, "/v2/outbound-messages")
-
-		headers = {
-			"Authorization": f"Bearer {api_key}",
-			"Content-Type": "application/json"
-		}
-
-		response = requests.get(api_endpoint, headers=headers, params={"request_id": self.id})
-		response.raise_for_status()
-
-		response_data = response.json()
+		response_data = get_freshchat_client().get_outbound_messages(self.id)
 
 		message_data = response_data.get("outbound_messages")
 		message_data = message_data[0] if message_data else None
@@ -578,23 +721,139 @@ class WhatsAppMessage(Document):
 		return out
 
 
+# Order of outgoing message statuses, a message can only move to a status of a higher rank
+whatsapp_status_ranks = {
+	"Not Sent": 0,
+	"Sending": 1,
+	"Queued": 2,
+	"Sent": 3,
+	"Undelivered": 4,
+	"Failed": 4,
+	"Delivered": 5,
+	"Read": 6,
+}
+
+twilio_message_statuses = {
+	"accepted": "Queued",
+	"scheduled": "Queued",
+	"queued": "Queued",
+	"sending": "Queued",
+	"sent": "Sent",
+	"delivered": "Delivered",
+	"undelivered": "Undelivered",
+	"failed": "Failed",
+	"canceled": "Failed",
+	"read": "Read",
+}
+
+
+def get_twilio_message_status(twilio_status):
+	return twilio_message_statuses.get(cstr(twilio_status).lower())
+
+
+def update_message_status_if_newer(message_name, status, error=None):
+	"""Set the status of the message only if it moves the message forward.
+	The row is locked while its current status is compared, so concurrent updates of a message are applied one after the other.
+	Returns the previous status, or None if the status update is stale or a duplicate and nothing was written.
+	"""
+	rank = whatsapp_status_ranks.get(status)
+	if rank is None:
+		return None
+
+	current = frappe.db.sql("""
+		select status
+		from `tabWhatsApp Message`
+		where name = %s
+		for update
+	""", message_name)
+	if not current:
+		return None
+
+	# Statuses without a rank like Error and Expired are final
+	previous_status = current[0][0]
+	if whatsapp_status_ranks.get(previous_status, len(whatsapp_status_ranks)) >= rank:
+		return None
+
+	values = {"status": status}
+	if error is not None:
+		values["error"] = error
+
+	frappe.db.set_value("WhatsApp Message", message_name, values)
+	return previous_status
+
+
 def outgoing_message_status_callback(args, auto_commit=False):
-	message = frappe.db.get_value("WhatsApp Message", filters={
-		'id': args.MessageSid,
-		'from_': args.From,
-		'to': args.To
-	}, fieldname=["name", "communication"], as_dict=1)
-
-	if message:
-		frappe.db.set_value("WhatsApp Message", message.name, {
-			"status": args.MessageStatus.title(),
-		})
-		if auto_commit:
-			frappe.db.commit()
+	status_update = get_twilio_status_update(args)
+	if not status_update:
+		return
+
+	status = status_update.status
+
+	# Callbacks of a message arrive within seconds of each other, only apply the latest one in the window
+	window = get_status_update_coalescing_window()
+	if window:
+		buffer_status_update(status_update, whatsapp_status_ranks[status], window)
+	else:
+		apply_status_updates([status_update], auto_commit=auto_commit, buffer_missing=True)
+
+
+# Seconds to wait for the send result of a message to be saved before applying a status callback received before it
+UNSAVED_MESSAGE_STATUS_WINDOW = 30
+
+
+def get_twilio_status_update(args):
+	"""Status update from the arguments of a Twilio status callback"""
+	status = get_twilio_message_status(args.MessageStatus)
+	if not status:
+		return None
+
+	return frappe._dict({
+		"id": args.MessageSid,
+		"from_": args.From,
+		"to": args.To,
+		"status": status,
+	})
+
+
+def apply_status_updates(status_updates, auto_commit=False, buffer_missing=False):
+	"""Apply provider status updates to messages and update each affected Communication once.
+	Send results are written in batches, so a callback can arrive before the id of its message is saved.
+	If `buffer_missing` is set, such status updates are buffered and applied by the next flush of the status buffer,
+	otherwise they are left to status reconciliation.
+	"""
+	messages = frappe.get_all("WhatsApp Message", filters={
+		"id": ("in", [d.id for d in status_updates]),
+	}, fields=["name", "id", "from_", "to", "communication", "status"])
+	messages = {(d.id, d.from_, d.to): d for d in messages}
+
+	communications = []
+	for status_update in status_updates:
+		message = messages.get((status_update.id, status_update.from_, status_update.to))
+		if not message:
+			if buffer_missing:
+				buffer_status_update(
+					status_update,
+					whatsapp_status_ranks[status_update.status],
+					max(get_status_update_coalescing_window(), UNSAVED_MESSAGE_STATUS_WINDOW),
+				)
+			continue
+
+		# Out of order and duplicate callbacks are dropped without writing
+		previous_status = update_message_status_if_newer(message.name, status_update.status)
+		if not previous_status:
+			continue
 
 		if message.communication:
-			comm = frappe.get_doc("Communication", message.communication)
-			comm.set_delivery_status(commit=auto_commit)
+			record_whatsapp_status_change(message.communication, previous_status, status_update.status)
+			if message.communication not in communications:
+				communications.append(message.communication)
+
+	if auto_commit:
+		frappe.db.commit()
+
+	for communication in communications:
+		comm = frappe.get_doc("Communication", communication)
+		comm.set_delivery_status(commit=auto_commit)
 
 
 def run_before_send_method(doc=None, notification_type=None):
@@ -636,6 +895,14 @@ def is_whatsapp_enabled(whatsapp_provider=None):
 		return False
 
 
+CLAIM_BATCH_SIZE = 50
+LEASE_SECONDS = 300
+BULK_SEND_THRESHOLD = 20
+BULK_SEND_CHUNK_SIZE = 100
+RETRY_BACKOFF_SECONDS = 5 * 60
+MAX_RETRY_BACKOFF_SECONDS = 60 * 60
+
+
 def flush_outgoing_message_queue(from_test=False):
 	"""Flush queued WhatsApp Messages, called from scheduler"""
 	auto_commit = not from_test
@@ -644,27 +911,146 @@ def flush_outgoing_message_queue(from_test=False):
 		frappe.msgprint(_("WhatsApp messages are muted"))
 		return
 
-	for message_name in get_queued_outgoing_messages():
-		send_whatsapp_message(message_name, auto_commit=auto_commit)
+	if from_test:
+		for message_name in get_queued_outgoing_messages():
+			send_whatsapp_message(message_name, auto_commit=auto_commit)
+		return
+
+	recover_expired_message_leases()
+
+	# Messages of providers with an open circuit are left in the queue
+	whatsapp_providers = get_available_providers()
+	if not whatsapp_providers:
+		return
+
+	for i in range(500 // CLAIM_BATCH_SIZE):
+		messages = claim_outgoing_messages(limit=CLAIM_BATCH_SIZE, whatsapp_providers=whatsapp_providers)
+		if not messages:
+			break
+
+		send_claimed_messages(messages)
+
+
+def send_whatsapp_messages(message_names):
+	"""Send a chunk of queued messages, enqueued by bulk sending"""
+	if are_whatsapp_messages_muted():
+		return
+
+	whatsapp_providers = get_available_providers()
+	if not whatsapp_providers:
+		return
+
+	for i in range(0, len(message_names), CLAIM_BATCH_SIZE):
+		messages = claim_outgoing_messages(
+			message_names=message_names[i:i + CLAIM_BATCH_SIZE],
+			whatsapp_providers=whatsapp_providers,
+		)
+		send_claimed_messages(messages)
+
+
+def send_claimed_messages(messages):
+	if not messages:
+		return
+
+	if is_concurrent_dispatch_enabled():
+		dispatch_outgoing_messages(messages)
+	else:
+		for d in messages:
+			send_claimed_message(d)
+
+		flush_status_write_back()
+
+
+def dispatch_outgoing_messages(messages):
+	"""Send claimed messages concurrently with a separate pool of threads for each WhatsApp Provider"""
+	messages_by_provider = {}
+	for d in messages:
+		messages_by_provider.setdefault(d.whatsapp_provider, []).append(d)
+
+	threads = []
+	for whatsapp_provider, provider_messages in messages_by_provider.items():
+		threads += map_in_site_threads(
+			send_claimed_message,
+			provider_messages,
+			max_workers=get_send_concurrency(whatsapp_provider),
+			wait=False,
+			finalize=flush_status_write_back,
+		)
+
+	for thread in threads:
+		thread.join()
+
+
+def send_claimed_message(claim):
+	send_whatsapp_message(
+		claim.name,
+		lease_owner=claim.lease_owner,
+		lease_expires_at=claim.lease_expires_at,
+		write_back=get_status_write_back(),
+	)
+
+
+def is_concurrent_dispatch_enabled():
+	return any(get_send_concurrency(whatsapp_provider) > 1 for whatsapp_provider in ("Twilio", "Freshchat"))
+
+
+def get_send_concurrency(whatsapp_provider):
+	fieldname = {
+		"Twilio": "twilio_send_concurrency",
+		"Freshchat": "freshchat_send_concurrency",
+	}.get(whatsapp_provider)
+
+	if not fieldname:
+		return 1
+
+	return max(cint(frappe.get_cached_value("WhatsApp Settings", None, fieldname)), 1)
 
 
-def send_whatsapp_message(message_name, auto_commit=True, now=False):
+def send_whatsapp_message(message_name, auto_commit=True, now=False, lease_owner=None, lease_expires_at=None, write_back=None):
+	"""Send a queued WhatsApp Message.
+	If `lease_owner` is provided, the message must have been claimed by it using `claim_outgoing_messages`
+	If `write_back` is provided along with `lease_owner`, the send result is collected in it and written with the rest of its batch
+	"""
 	from frappe.email.doctype.notification.notification import get_doc_for_notification_triggers
 
-	message_doc = frappe.get_doc("WhatsApp Message", message_name, for_update=True)
+	# Claimed messages are already locked out from other workers by the lease
+	message_doc = frappe.get_doc("WhatsApp Message", message_name, for_update=not lease_owner)
+
+	if lease_owner:
+		if message_doc.status != "Sending" or message_doc.lease_owner != lease_owner:
+			return
+	elif message_doc.status != "Not Sent" or message_doc.sent_received != "Sent":
+		if auto_commit:
+			frappe.db.rollback()
+		return
 
 	if are_whatsapp_messages_muted(message_doc.whatsapp_provider):
+		if lease_owner:
+			release_claimed_messages([message_doc.name], lease_owner)
+
 		frappe.msgprint(_("WhatsApp messages are muted"))
 		return
 
-	if message_doc.status != "Not Sent" or message_doc.sent_received != "Sent":
-		if auto_commit:
+	# Leave the message queued while the provider is down, or for the next flush if the rate limit takes too long
+	if (
+		not get_provider_circuit_breaker(message_doc.whatsapp_provider).allow_request()
+		or not acquire_send_token(message_doc.whatsapp_provider, message_doc.from_)
+	):
+		if lease_owner:
+			release_claimed_messages([message_doc.name], lease_owner)
+		elif auto_commit:
 			frappe.db.rollback()
 		return
 
-	message_doc.db_set("status", "Sending", commit=auto_commit)
-	if message_doc.communication:
-		frappe.get_doc('Communication', message_doc.communication).set_delivery_status(commit=auto_commit)
+	# Waiting on earlier sends of the batch and the rate limit may have used up most of the lease.
+	# Extend it before the provider call, and do not send if another worker has recovered the message.
+	if lease_owner and is_lease_renewal_due(lease_expires_at) and not renew_message_lease(message_doc.name, lease_owner):
+		return
+
+	if not lease_owner:
+		message_doc.db_set("status", "Sending", commit=auto_commit)
+		if message_doc.communication:
+			frappe.get_doc('Communication', message_doc.communication).set_delivery_status(commit=auto_commit)
 
 	try:
 		doc = get_doc_for_notification_triggers(message_doc.reference_doctype, message_doc.reference_name)
@@ -676,42 +1062,42 @@ def send_whatsapp_message(message_name, auto_commit=True, now=False):
 		elif whatsapp_provider == "Freshchat":
 			result = message_doc.send_whatsapp_via_freshchat()
 		else:
-			frappe.throw(_("Please configure WhatsApp Provider"))
+			frappe.throw(_("Please configure WhatsApp Provider"), exc=WhatsAppConfigurationError)
+
+		record_provider_call(whatsapp_provider)
 
-		message_doc.db_set({
+		set_send_result(message_doc, {
 			"id": result.get("id"),
 			"status": result.get("status"),
 			"date_sent": result.get("date_sent"),
 			"error": result.get("error"),
-		}, commit=auto_commit)
-
-		if message_doc.communication:
-			frappe.get_doc('Communication', message_doc.communication).set_delivery_status(commit=auto_commit)
-
-		run_after_send_method(
-			reference_doctype=message_doc.reference_doctype,
-			reference_name=message_doc.reference_name,
-			notification_type=message_doc.notification_type
-		)
+		}, auto_commit=auto_commit, lease_owner=lease_owner, write_back=write_back, after_send=frappe._dict({
+			"reference_doctype": message_doc.reference_doctype,
+			"reference_name": message_doc.reference_name,
+			"notification_type": message_doc.notification_type,
+		}))
 
 	except Exception as e:
-		if auto_commit:
+		if auto_commit or lease_owner:
 			frappe.db.rollback()
 
-		if message_doc.retry < 3:
-			message_doc.db_set({
+		error = classify_provider_error(e)
+		record_provider_error(message_doc.whatsapp_provider, error)
+		record_provider_call(message_doc.whatsapp_provider, error)
+
+		# Permanent failures like invalid recipients would fail again, do not retry them
+		if error.retryable and message_doc.retry < 3:
+			set_send_result(message_doc, {
 				"status": "Not Sent",
 				"retry": message_doc.retry + 1,
+				"next_retry_at": get_next_retry_at(message_doc.retry + 1),
 				"error": str(e),
-			}, commit=auto_commit)
+			}, auto_commit=auto_commit, lease_owner=lease_owner, write_back=write_back)
 		else:
-			message_doc.db_set({
+			set_send_result(message_doc, {
 				"status": "Error",
 				"error": str(e),
-			}, commit=auto_commit)
-
-		if message_doc.communication:
-			frappe.get_doc('Communication', message_doc.communication).set_delivery_status(commit=auto_commit)
+			}, auto_commit=auto_commit, lease_owner=lease_owner, write_back=write_back)
 
 		if now:
 			raise e
@@ -724,46 +1110,285 @@ def send_whatsapp_message(message_name, auto_commit=True, now=False):
 			)
 
 
+def set_send_result(message_doc, values, auto_commit=True, lease_owner=None, write_back=None, after_send=None):
+	"""Save the send result of a message and run `after_send` once it is saved.
+	Results of claimed messages are only saved if the message is still claimed by `lease_owner`.
+	With `write_back`, results of claimed messages are saved in bulk with the rest of the batch.
+	"""
+	values.update({
+		"lease_owner": None,
+		"lease_expires_at": None,
+	})
+
+	if lease_owner and write_back:
+		write_back.add(message_doc, lease_owner, values, after_send=after_send)
+		return
+
+	if lease_owner:
+		previous_status = update_claimed_message(message_doc.name, lease_owner, values)
+		if not previous_status:
+			return
+	else:
+		previous_status = message_doc.status
+		message_doc.db_set(values, commit=auto_commit)
+
+	if after_send:
+		run_after_send_method(**after_send)
+
+	if message_doc.communication:
+		record_whatsapp_status_change(message_doc.communication, previous_status, values.get("status"))
+		frappe.get_doc('Communication', message_doc.communication).set_delivery_status(commit=auto_commit)
+
+
+def update_claimed_message(message_name, lease_owner, values, status_field="status", claimed_status="Sending"):
+	"""Update a claimed message and commit if it is still claimed by `lease_owner`.
+	Returns the status of the message before the update, or None if the message is no longer claimed.
+	"""
+	claim = frappe.db.sql("""
+		select `{0}` as status, lease_owner
+		from `tabWhatsApp Message`
+		where name = %s
+		for update
+	""".format(status_field), message_name, as_dict=True)
+
+	if not claim or claim[0].status != claimed_status or claim[0].lease_owner != lease_owner:
+		frappe.db.rollback()
+		return None
+
+	frappe.db.set_value("WhatsApp Message", message_name, values)
+	frappe.db.commit()
+	return claim[0].status
+
+
+class MessageStatusWriteBack:
+	"""
+	Collects send results of claimed WhatsApp Messages and writes them with bulk updates and one commit per batch,
+	then updates the delivery status of each Communication once per batch.
+
+	Results are only written for messages still claimed by their lease owner. A message whose result was not written,
+	because the worker stopped or the write failed, is sent again once its lease expires, so sending is at least once.
+	"""
+	def __init__(self, batch_size=100):
+		self.batch_size = batch_size
+		self.results = []
+
+	def add(self, message_doc, lease_owner, values, after_send=None):
+		self.results.append(frappe._dict({
+			"name": message_doc.name,
+			"communication": message_doc.communication,
+			"lease_owner": lease_owner,
+			"values": values,
+			"after_send": after_send,
+		}))
+
+		if len(self.results) >= self.batch_size:
+			self.flush()
+
+	def flush(self):
+		if not self.results:
+			return
+
+		results, self.results = self.results, []
+
+		try:
+			results = write_claimed_send_results(results)
+			frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(title=_("Error Saving WhatsApp Message Send Results"), message=frappe.get_traceback())
+			return
+
+		communications = set()
+		for result in results:
+			if result.after_send:
+				run_after_send_method(**result.after_send)
+
+			if result.communication:
+				record_whatsapp_status_change(result.communication, "Sending", result.values.get("status"))
+				communications.add(result.communication)
+
+		for communication in communications:
+			frappe.get_doc("Communication", communication).set_delivery_status(commit=False)
+
+		frappe.db.commit()
+
+
+def write_claimed_send_results(results):
+	"""Write send results of messages still claimed by their lease owner with one update per lease owner.
+	Returns the results that were written.
+	"""
+	results_by_lease_owner = {}
+	for result in results:
+		results_by_lease_owner.setdefault(result.lease_owner, []).append(result)
+
+	written = []
+	for lease_owner, lease_results in results_by_lease_owner.items():
+		claimed_names = set(frappe.db.sql_list("""
+			select name
+			from `tabWhatsApp Message`
+			where name in %(names)s and status = 'Sending' and lease_owner = %(lease_owner)s
+			for update
+		""", {"names": [d.name for d in lease_results], "lease_owner": lease_owner}))
+
+		lease_results = [d for d in lease_results if d.name in claimed_names]
+		if lease_results:
+			bulk_update_messages({d.name: d.values for d in lease_results})
+			written += lease_results
+
+	return written
+
+
+def bulk_update_messages(values_by_name):
+	"""Set different values on each message with a single update statement"""
+	fieldnames = sorted({fieldname for values in values_by_name.values() for fieldname in values})
+
+	set_clauses = []
+	params = []
+	for fieldname in fieldnames:
+		cases = []
+		for name, values in values_by_name.items():
+			if fieldname in values:
+				cases.append("when %s then %s")
+				params += [name, values[fieldname]]
+
+		set_clauses.append("`{0}` = case name {1} else `{0}` end".format(fieldname, " ".join(cases)))
+
+	set_clauses.append("modified = %s")
+	params.append(now_datetime())
+
+	frappe.db.sql("""
+		update `tabWhatsApp Message`
+		set {0}
+		where name in %s
+	""".format(", ".join(set_clauses)), params + [list(values_by_name)])
+
+
+def get_status_write_back():
+	"""Status write back of the current thread"""
+	if not getattr(frappe.local, "whatsapp_status_write_back", None):
+		frappe.local.whatsapp_status_write_back = MessageStatusWriteBack()
+
+	return frappe.local.whatsapp_status_write_back
+
+
+def flush_status_write_back():
+	if getattr(frappe.local, "whatsapp_status_write_back", None):
+		frappe.local.whatsapp_status_write_back.flush()
+
+
+MAX_MEDIA_DOWNLOAD_BATCHES = 10
+MAX_MEDIA_DOWNLOAD_RETRIES = 3
+MEDIA_DOWNLOAD_BATCH_SIZE = 100
+MEDIA_DOWNLOAD_LEASE_SECONDS = 10 * 60
+MEDIA_DOWNLOAD_BUDGET_SECONDS = 10 * 60
+MEDIA_DOWNLOAD_ENQUEUED_KEY = "whatsapp_media_download_enqueued"
+
+
 def flush_incoming_media_queue(from_test=False):
-	"""Flush queued WhatsApp Messages, called from scheduler"""
+	"""Download queued incoming media concurrently, called from scheduler and when media is received"""
 	auto_commit = not from_test
+	frappe.cache().delete_value(MEDIA_DOWNLOAD_ENQUEUED_KEY)
 
 	if are_whatsapp_messages_muted():
 		frappe.msgprint(_("WhatsApp messages are muted"))
 		return
 
-	for message_name in get_queued_incoming_media_messages():
-		download_incoming_media(message_name, auto_commit=auto_commit)
+	if from_test:
+		for message_name in get_queued_incoming_media_messages():
+			download_incoming_media(message_name, auto_commit=auto_commit)
+		return
+
+	# Claimed messages leave the queue and failed downloads are rescheduled for later, so each batch only has new messages.
+	# No batch is started after the budget, so that the job finishes well within the timeout of the long queue.
+	deadline = time.monotonic() + MEDIA_DOWNLOAD_BUDGET_SECONDS
+	for i in range(MAX_MEDIA_DOWNLOAD_BATCHES):
+		if time.monotonic() > deadline:
+			break
+
+		claimed = claim_incoming_media_messages()
+		if not claimed:
+			break
+
+		map_in_site_threads(download_claimed_incoming_media, claimed, max_workers=get_media_download_concurrency())
+
+
+def enqueue_incoming_media_download():
+	"""Enqueue the media downloader unless a job is already waiting to be picked"""
+	key = frappe.cache().make_key(MEDIA_DOWNLOAD_ENQUEUED_KEY)
+	if frappe.cache().set(key, 1, nx=True, ex=60):
+		frappe.enqueue(
+			"twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message.flush_incoming_media_queue",
+			queue="long",
+		)
+
+
+def get_media_download_concurrency():
+	return cint(frappe.get_cached_value("WhatsApp Settings", None, "media_download_concurrency")) or 1
+
+
+def download_claimed_incoming_media(claim):
+	download_incoming_media(claim.name, lease_owner=claim.lease_owner)
 
 
-def download_incoming_media(message_name, auto_commit=True, now=False):
+def download_incoming_media(message_name, auto_commit=True, now=False, lease_owner=None):
+	"""
+	Download the media of an incoming message and attach it.
+	The message is claimed with a lease while downloading, unless it is already claimed by `lease_owner`.
+	Without `auto_commit` the message is locked until the end of the transaction instead.
+	"""
 	import mimetypes
 	import os
 
-	if isinstance(message_name, Document):
-		message_doc = message_name
+	message_doc = message_name if isinstance(message_name, Document) else None
+	message_name = message_doc.name if message_doc else message_name
+
+	if auto_commit and not lease_owner:
+		claimed = claim_incoming_media_messages(message_names=[message_name])
+		if not claimed:
+			return
+
+		lease_owner = claimed[0].lease_owner
+
+	if lease_owner:
+		if message_doc:
+			message_doc.reload()
+		else:
+			message_doc = frappe.get_doc("WhatsApp Message", message_name)
+
+		if message_doc.incoming_media_status != "Downloading" or message_doc.lease_owner != lease_owner:
+			return
 	else:
-		message_doc = frappe.get_doc("WhatsApp Message", message_name, for_update=True)
+		message_doc = message_doc or frappe.get_doc("WhatsApp Message", message_name, for_update=True)
+		if message_doc.incoming_media_status != "To Download" or message_doc.sent_received != "Received":
+			return
 
 	if are_whatsapp_messages_muted(message_doc.whatsapp_provider):
 		frappe.msgprint(_("WhatsApp messages are muted"))
+		set_incoming_media_result(message_doc, {
+			"incoming_media_status": "To Download",
+			"next_retry_at": get_next_retry_at(cint(message_doc.retry) + 1),
+		}, auto_commit=auto_commit, lease_owner=lease_owner)
 		return
 
-	if message_doc.incoming_media_status != "To Download" or message_doc.sent_received != "Received":
-		if auto_commit:
-			frappe.db.rollback()
+	# Downloads interrupted before finishing count as failed attempts when their lease is recovered
+	if cint(message_doc.retry) > MAX_MEDIA_DOWNLOAD_RETRIES:
+		set_incoming_media_result(message_doc, {
+			"incoming_media_status": "Error",
+			"error": _("Media download did not finish"),
+		}, auto_commit=auto_commit, lease_owner=lease_owner)
 		return
 
-	attachment = message_doc.get_attachment()
-	if not attachment or not attachment.get("media_url") or attachment.get("fid"):
-		message_doc.db_set({
-			"incoming_media_status": "Attached" if attachment and attachment.get("fid") else None
-		}, commit=auto_commit)
-		return
+	try:
+		attachment = message_doc.get_attachment()
+		if not attachment or not attachment.get("media_url") or attachment.get("fid"):
+			set_incoming_media_result(message_doc, {
+				"incoming_media_status": "Attached" if attachment and attachment.get("fid") else None
+			}, auto_commit=auto_commit, lease_owner=lease_owner)
+			return
 
-	message_doc.db_set("incoming_media_status", "Downloading", commit=auto_commit)
+		if not lease_owner:
+			message_doc.db_set("incoming_media_status", "Downloading", commit=auto_commit)
 
-	try:
 		media_url = attachment.get("media_url")
 		mime_type = attachment.get("mime_type")
 
@@ -771,48 +1396,42 @@ def download_incoming_media(message_name, auto_commit=True, now=False):
 		media_sid = os.path.basename(urlparse(media_url).path)
 		filename = '{sid}{ext}'.format(sid=media_sid, ext=file_extension)
 
-		response = Twilio.download_media_request(media_url)
+		stored_media = download_media(media_url, file_extension, get_max_incoming_media_size())
 
-		file_data = frappe._dict(file_name=filename, is_private=1)
 		if message_doc.communication:
-			file_data.attached_to_doctype = "Communication"
-			file_data.attached_to_name = message_doc.communication
+			file = make_media_file(stored_media, filename, "Communication", message_doc.communication)
 		else:
-			file_data.attached_to_doctype = message_doc.doctype
-			file_data.attached_to_name = message_doc.name
-
-		file = frappe.new_doc("File", **file_data)
-		file.content = response.content
-		file.insert(ignore_permissions=True)
-
-		fid = file.name
-
-		if message_doc.communication:
-			frappe.get_doc("Communication", message_doc.communication).notify_change("update")
+			file = make_media_file(stored_media, filename, message_doc.doctype, message_doc.name)
 
 		updated_attachment = attachment.copy()
-		updated_attachment["fid"] = fid
-		message_doc.db_set({
+		updated_attachment["fid"] = file.name
+
+		# The File is rolled back with the result if the claim was lost meanwhile
+		is_saved = set_incoming_media_result(message_doc, {
 			"incoming_media_status": "Attached",
 			"attachment": json.dumps(updated_attachment),
 			"error": None,
-		}, commit=auto_commit)
+		}, auto_commit=auto_commit, lease_owner=lease_owner)
+
+		if is_saved and message_doc.communication:
+			frappe.get_doc("Communication", message_doc.communication).notify_change("update")
 
 	except Exception as e:
 		if auto_commit:
 			frappe.db.rollback()
 
-		if message_doc.retry < 3:
-			message_doc.db_set({
+		# Every failure moves the retry count forward, so a message failing the same way is not retried forever
+		retry = cint(message_doc.retry) + 1
+		values = {"retry": retry, "error": str(e)}
+		if retry <= MAX_MEDIA_DOWNLOAD_RETRIES and not isinstance(e, MediaTooLargeError):
+			values.update({
 				"incoming_media_status": "To Download",
-				"retry": message_doc.retry + 1,
-				"error": str(e),
-			}, commit=auto_commit)
+				"next_retry_at": get_next_retry_at(retry),
+			})
 		else:
-			message_doc.db_set({
-				"incoming_media_status": "Error",
-				"error": str(e),
-			}, commit=auto_commit)
+			values["incoming_media_status"] = "Error"
+
+		set_incoming_media_result(message_doc, values, auto_commit=auto_commit, lease_owner=lease_owner)
 
 		if now:
 			raise e
@@ -825,14 +1444,140 @@ def download_incoming_media(message_name, auto_commit=True, now=False):
 			)
 
 
+def set_incoming_media_result(message_doc, values, auto_commit=True, lease_owner=None):
+	"""Save the result of a media download. Returns False if the message is no longer claimed by `lease_owner`"""
+	if not lease_owner:
+		message_doc.db_set(values, commit=auto_commit)
+		return True
+
+	values = dict(values, lease_owner=None, lease_expires_at=None)
+	if not update_claimed_message(message_doc.name, lease_owner, values,
+			status_field="incoming_media_status", claimed_status="Downloading"):
+		return False
+
+	message_doc.update(values)
+	return True
+
+
+def download_media(media_url, extension=None, max_size=None):
+	"""Stream media to content addressed storage without holding it in memory, enforcing the size limit while reading"""
+	with Twilio.download_media_request(media_url, stream=True) as response:
+		if max_size and cint(response.headers.get("Content-Length")) > max_size:
+			raise_media_too_large(max_size)
+
+		return store_media_stream(
+			response.iter_content(chunk_size=MEDIA_CHUNK_SIZE),
+			extension=extension,
+			max_size=max_size,
+		)
+
+
+def get_max_incoming_media_size():
+	return cint(frappe.get_cached_value("WhatsApp Settings", None, "max_incoming_media_size")) * 1024 * 1024
+
+
+def get_next_retry_at(retry):
+	"""Exponential backoff with jitter for the given retry count"""
+	delay = min(RETRY_BACKOFF_SECONDS * 2 ** max(retry - 1, 0), MAX_RETRY_BACKOFF_SECONDS)
+	return add_to_date(now_datetime(), seconds=random.uniform(delay / 2, delay))
+
+
 def get_queued_outgoing_messages():
 	return frappe.db.sql_list("""
 		select name
 		from `tabWhatsApp Message`
 		where status = 'Not Sent' and sent_received = 'Sent'
+			and (next_retry_at is null or next_retry_at <= %s)
 		order by priority desc, creation asc
 		limit 500
-	""")
+	""", now_datetime())
+
+
+def claim_outgoing_messages(limit=CLAIM_BATCH_SIZE, lease_seconds=LEASE_SECONDS, message_names=None, whatsapp_providers=None):
+	"""
+	Claim a batch of queued messages for this worker by setting them as 'Sending' with a lease.
+	Rows locked by other workers claiming at the same time are skipped instead of waited upon.
+	If `message_names` or `whatsapp_providers` are provided, only matching messages are claimed.
+	"""
+	lease_owner = make_lease_owner()
+	lease_expires_at = add_to_date(now_datetime(), seconds=lease_seconds)
+
+	conditions = ""
+	if message_names:
+		conditions += " and name in %(message_names)s"
+		limit = len(message_names)
+	if whatsapp_providers:
+		conditions += " and whatsapp_provider in %(whatsapp_providers)s"
+
+	messages = frappe.db.sql("""
+		select name, whatsapp_provider
+		from `tabWhatsApp Message`
+		where status = 'Not Sent' and sent_received = 'Sent'
+			and (next_retry_at is null or next_retry_at <= %(now)s){0}
+		order by priority desc, creation asc
+		limit %(limit)s
+		for update skip locked
+	""".format(conditions), {
+		"limit": limit,
+		"message_names": message_names,
+		"whatsapp_providers": whatsapp_providers,
+		"now": now_datetime(),
+	}, as_dict=True)
+
+	if messages:
+		frappe.db.sql("""
+			update `tabWhatsApp Message`
+			set status = 'Sending', lease_owner = %(lease_owner)s, lease_expires_at = %(lease_expires_at)s
+			where name in %(names)s
+		""", {
+			"lease_owner": lease_owner,
+			"lease_expires_at": lease_expires_at,
+			"names": [d.name for d in messages],
+		})
+
+	frappe.db.commit()
+
+	for d in messages:
+		d.lease_owner = lease_owner
+		d.lease_expires_at = lease_expires_at
+
+	return messages
+
+
+def release_claimed_messages(message_names, lease_owner):
+	"""Put claimed messages back in the queue without counting a retry"""
+	frappe.db.sql("""
+		update `tabWhatsApp Message`
+		set status = 'Not Sent', lease_owner = null, lease_expires_at = null
+		where name in %(names)s and status = 'Sending' and lease_owner = %(lease_owner)s
+	""", {"names": message_names, "lease_owner": lease_owner})
+	frappe.db.commit()
+
+
+def recover_expired_message_leases():
+	"""Put messages claimed by workers that did not finish sending them back in the queue"""
+	frappe.db.sql("""
+		update `tabWhatsApp Message`
+		set status = 'Not Sent', lease_owner = null, lease_expires_at = null
+		where status = 'Sending' and lease_expires_at < %s
+	""", now_datetime())
+	frappe.db.commit()
+
+
+def is_lease_renewal_due(lease_expires_at, lease_seconds=LEASE_SECONDS):
+	"""Leases are renewed once half of them is used up, or always if the expiry is not known"""
+	return not lease_expires_at or get_datetime(lease_expires_at) < add_to_date(now_datetime(), seconds=lease_seconds / 2)
+
+
+def renew_message_lease(message_name, lease_owner, lease_seconds=LEASE_SECONDS):
+	"""Extend the lease of a claimed message. Returns False if the message is no longer claimed by `lease_owner`"""
+	return bool(update_claimed_message(message_name, lease_owner, {
+		"lease_expires_at": add_to_date(now_datetime(), seconds=lease_seconds),
+	}))
+
+
+def make_lease_owner():
+	return f"{socket.gethostname()}:{os.getpid()}:{frappe.generate_hash(length=8)}"
 
 
 def get_queued_incoming_media_messages():
@@ -840,34 +1585,158 @@ def get_queued_incoming_media_messages():
 		select name
 		from `tabWhatsApp Message`
 		where incoming_media_status = 'To Download' and sent_received = 'Received'
+			and (next_retry_at is null or next_retry_at <= %s)
 		order by priority desc, creation asc
-		limit 100
-	""")
+		limit %s
+	""", (now_datetime(), MEDIA_DOWNLOAD_BATCH_SIZE))
+
+
+def claim_incoming_media_messages(limit=MEDIA_DOWNLOAD_BATCH_SIZE, lease_seconds=MEDIA_DOWNLOAD_LEASE_SECONDS, message_names=None):
+	"""
+	Claim a batch of queued incoming media downloads for this worker by setting them as 'Downloading' with a lease.
+	Downloads whose lease expired are claimed again and count as a failed attempt.
+	"""
+	lease_owner = make_lease_owner()
+	now = now_datetime()
+
+	conditions = ""
+	if message_names:
+		conditions += " and name in %(message_names)s"
+		limit = len(message_names)
+
+	claimed_names = frappe.db.sql_list("""
+		select name
+		from `tabWhatsApp Message`
+		where sent_received = 'Received'
+			and (
+				(incoming_media_status = 'To Download' and (next_retry_at is null or next_retry_at <= %(now)s))
+				or (incoming_media_status = 'Downloading' and lease_expires_at < %(now)s)
+			){0}
+		order by priority desc, creation asc
+		limit %(limit)s
+		for update skip locked
+	""".format(conditions), {
+		"limit": limit,
+		"message_names": message_names,
+		"now": now,
+	})
+
+	if claimed_names:
+		# retry is set first as assignments see the values set before them
+		frappe.db.sql("""
+			update `tabWhatsApp Message`
+			set retry = case when incoming_media_status = 'Downloading' then retry + 1 else retry end,
+				incoming_media_status = 'Downloading',
+				lease_owner = %(lease_owner)s,
+				lease_expires_at = %(lease_expires_at)s
+			where name in %(names)s
+		""", {
+			"lease_owner": lease_owner,
+			"lease_expires_at": add_to_date(now, seconds=lease_seconds),
+			"names": claimed_names,
+		})
+
+	frappe.db.commit()
+
+	return [frappe._dict(name=name, lease_owner=lease_owner) for name in claimed_names]
 
 
 def expire_whatsapp_message_queue():
 	"""Expire WhatsApp messages not sent for 7 days. Called daily via scheduler."""
+	communications = frappe.db.sql_list("""
+		SELECT DISTINCT communication
+		FROM `tabWhatsApp Message`
+		WHERE modified < (NOW() - INTERVAL '7' DAY) AND status = 'Not Sent'
+	""")
+
 	frappe.db.sql("""
 		UPDATE `tabWhatsApp Message`
 		SET status = 'Expired'
 		WHERE modified < (NOW() - INTERVAL '7' DAY) AND status = 'Not Sent'
 	""")
 
+	frappe.db.after_commit.add(lambda: clear_whatsapp_status_counts(communications))
 
-def incoming_message_callback(args):
-	out = frappe._dict({
-		"reply_message": None,
-		"disable_default_reply": False,
-	})
 
-	# Determine previous outgoing message for context
+def get_incoming_context_message(args):
+	"""Determine previous outgoing message for context"""
 	if args.OriginalRepliedMessageSid:
-		context_message_name = WhatsAppMessage.get_replied_to_message(
+		return WhatsAppMessage.get_replied_to_message(
 			args.OriginalRepliedMessageSid,
 			args.OriginalRepliedMessageSender
 		)
 	else:
-		context_message_name = WhatsAppMessage.get_last_indirect_reply_message(args.From, args.To)
+		return WhatsAppMessage.get_last_indirect_reply_message(args.From, args.To)
+
+
+def is_inline_reply_required(context_message_name):
+	"""Check if the reply handler of the context message needs to reply in the webhook response"""
+	if not context_message_name:
+		return False
+
+	reply_handler, reply_handler_expired = frappe.db.get_value(
+		"WhatsApp Message", context_message_name, ["reply_handler", "reply_handler_expired"]
+	)
+	if not reply_handler or reply_handler_expired:
+		return False
+
+	return cint(frappe.get_cached_value("WhatsApp Reply Handler", reply_handler, "requires_inline_reply"))
+
+
+def should_process_incoming_message_in_background(context_message_name):
+	if not cint(frappe.get_cached_value("WhatsApp Settings", None, "process_incoming_messages_in_background")):
+		return False
+
+	return not is_inline_reply_required(context_message_name)
+
+
+def get_incoming_reply_message(response):
+	"""Reply message of the reply handler, else the default auto reply"""
+	if cstr(response.get("reply_message")).strip():
+		return response.get("reply_message")
+
+	if not response.get("disable_default_reply"):
+		return frappe.db.get_single_value('WhatsApp Settings', 'reply_message')
+
+
+def process_incoming_message(message_args, context_message_name=None):
+	"""Process an incoming message acknowledged by the webhook and send the reply via the API"""
+	frappe.set_user("Administrator")
+	message_args = frappe._dict(message_args)
+
+	response = incoming_message_callback(message_args, context_message_name=context_message_name)
+	reply_message = get_incoming_reply_message(response)
+	if not reply_message:
+		return
+
+	incoming_message = response.incoming_message or frappe._dict()
+	WhatsAppMessage.send_whatsapp_message(
+		receiver_list=[message_args.From.replace("whatsapp:", "")],
+		message=reply_message,
+		reference_doctype=incoming_message.reference_doctype,
+		reference_name=incoming_message.reference_name,
+		party_doctype=incoming_message.party_doctype,
+		party=incoming_message.party,
+		whatsapp_provider="Twilio",
+		automated=True,
+	)
+	frappe.db.commit()
+
+
+def incoming_message_callback(args, context_message_name=None):
+	out = frappe._dict({
+		"reply_message": None,
+		"disable_default_reply": False,
+		"incoming_message": None,
+	})
+
+	# Twilio retries and replayed webhooks must not store the message or reply to it again
+	if args.MessageSid and frappe.db.exists("WhatsApp Message", {"id": args.MessageSid, "sent_received": "Received"}):
+		out.disable_default_reply = True
+		return out
+
+	if not context_message_name:
+		context_message_name = get_incoming_context_message(args)
 
 	# Do not receive message if there is no context
 	if not context_message_name:
@@ -930,6 +1799,7 @@ def incoming_message_callback(args):
 	)
 
 	incoming_message.insert(ignore_permissions=True)
+	out.incoming_message = incoming_message
 
 	frappe.db.commit()
 
@@ -937,12 +1807,7 @@ def incoming_message_callback(args):
 	if reply_handler and reply_handler.download_media_before_handling:
 		download_incoming_media(incoming_message)
 	elif incoming_message.incoming_media_status == "To Download":
-		frappe.enqueue(
-			"twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message.download_incoming_media",
-			message_name=incoming_message.name,
-			enqueue_after_commit=False,
-			queue="long",
-		)
+		enqueue_incoming_media_download()
 
 	# Handle reply
 	if reply_handler and not context_message.reply_handler_expired:
@@ -967,17 +1832,169 @@ def incoming_message_callback(args):
 	return out
 
 
-def update_messages_pending_status_reconciliation(limit=100, auto_commit=True):
+RECONCILIATION_CONCURRENCY = 8
+# Minutes to wait before each status check of a message, the last interval repeats until the cutoff
+RECONCILIATION_INTERVALS = [5, 30, 2 * 60, 24 * 60]
+RECONCILIATION_CUTOFF_DAYS = 7
+RECONCILIATION_DEFAULT_LIMIT = 500
+RECONCILIATION_MAX_LIMIT = 5000
+# Share of a minute of the provider's rate budget used by each reconciliation run
+RECONCILIATION_BUDGET_SECONDS = 60
+RECONCILIATION_WINDOW_MARGIN_MINUTES = 60
+RECONCILIATION_LIST_LIMIT_FACTOR = 20
+RECONCILIATION_LOCK_SECONDS = 30 * 60
+
+
+def enqueue_status_reconciliation():
+	"""Run status reconciliation in the long queue, a run can outlast the timeout of the default queue"""
+	if is_reconciliation_locked():
+		return
+
+	frappe.enqueue(
+		"twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message.update_messages_pending_status_reconciliation",
+		queue="long",
+	)
+
+
+def update_messages_pending_status_reconciliation(limit=None, auto_commit=True):
 	"""
-	Reconcile delivery status for all messages with status 'Sent' or 'Queued'
-	This method processes messages in batches with proper error handling
+	Reconcile delivery status of messages with status 'Sent' or 'Queued' that are due for a status check
+	Twilio statuses are pulled in bulk from the message list, other messages are fetched one by one in parallel
 	"""
 	if are_whatsapp_messages_muted():
 		frappe.msgprint(_("WhatsApp messages are muted"))
 		return
 
-	for name in get_messages_pending_status_reconciliation(limit):
-		reconcile_message_status(name, auto_commit=auto_commit)
+	# A run taking longer than the cron interval would otherwise overlap with the next one
+	if not acquire_reconciliation_lock():
+		return
+
+	try:
+		reconcile_pending_message_statuses(limit=limit, auto_commit=auto_commit)
+	finally:
+		release_reconciliation_lock()
+
+
+def reconcile_pending_message_statuses(limit=None, auto_commit=True):
+	whatsapp_providers = get_available_providers()
+	if not whatsapp_providers:
+		return
+
+	limit = limit or get_reconciliation_limit(whatsapp_providers)
+	messages = get_messages_pending_status_reconciliation(limit, whatsapp_providers=whatsapp_providers)
+	if not messages:
+		return
+
+	mark_message_statuses_checked([d.name for d in messages])
+	if auto_commit:
+		frappe.db.commit()
+
+	twilio_messages = [d for d in messages if d.whatsapp_provider == "Twilio"]
+	remaining_names = [d.name for d in messages if d.whatsapp_provider != "Twilio"]
+
+	if twilio_messages:
+		try:
+			remaining_names += reconcile_twilio_message_statuses(twilio_messages, auto_commit=auto_commit)
+		except Exception as e:
+			if auto_commit:
+				frappe.db.rollback()
+
+			record_provider_call("Twilio", classify_provider_error(e))
+			frappe.log_error(title=_("Error Reconciling WhatsApp Message Delivery Status"), message=frappe.get_traceback())
+			remaining_names += [d.name for d in twilio_messages]
+
+	if auto_commit:
+		map_in_site_threads(reconcile_message_status, remaining_names, max_workers=RECONCILIATION_CONCURRENCY)
+	else:
+		for name in remaining_names:
+			reconcile_message_status(name, auto_commit=auto_commit)
+
+
+def acquire_reconciliation_lock():
+	return frappe.cache().set(get_reconciliation_lock_key(), frappe.local.site, nx=True, ex=RECONCILIATION_LOCK_SECONDS)
+
+
+def release_reconciliation_lock():
+	frappe.cache().delete(get_reconciliation_lock_key())
+
+
+def is_reconciliation_locked():
+	return cache_key_exists(get_reconciliation_lock_key())
+
+
+def get_reconciliation_lock_key():
+	return frappe.cache().make_key("whatsapp_status_reconciliation_lock")
+
+
+def reconcile_twilio_message_statuses(messages, auto_commit=True):
+	"""Match messages with the Twilio message list of their sender within their sending window.
+	Returns names of messages not found in the list
+	"""
+	messages_by_sender = {}
+	for message in messages:
+		messages_by_sender.setdefault(message.from_, []).append(message)
+
+	status_updates = []
+	remaining_names = []
+
+	for from_, sender_messages in messages_by_sender.items():
+		for date_sent_after, date_sent_before, bucket in get_reconciliation_windows(sender_messages):
+			pending = {d.id: d for d in bucket}
+
+			twilio_messages = Twilio.stream_messages(
+				from_=from_,
+				date_sent_after=convert_system_timezone_to_utc(date_sent_after),
+				date_sent_before=convert_system_timezone_to_utc(date_sent_before),
+				limit=len(pending) * RECONCILIATION_LIST_LIMIT_FACTOR,
+			)
+
+			for twilio_message in twilio_messages:
+				message = pending.pop(twilio_message.sid, None)
+				if message:
+					status = get_twilio_message_status(twilio_message.status)
+					if status and status != message.status:
+						status_updates.append(frappe._dict({
+							"id": message.id,
+							"from_": message.from_,
+							"to": message.to,
+							"status": status,
+						}))
+
+				if not pending:
+					break
+
+			remaining_names += [d.name for d in pending.values()]
+
+	record_provider_call("Twilio")
+
+	if status_updates:
+		apply_status_updates(status_updates, auto_commit=auto_commit)
+
+	return remaining_names
+
+
+def get_reconciliation_windows(messages):
+	"""
+	Group messages of a sender into buckets sent close to each other and return the sending window of each bucket,
+	so that a few old messages do not make the message list span every message sent since then
+	"""
+	margin = timedelta(minutes=RECONCILIATION_WINDOW_MARGIN_MINUTES)
+	messages = sorted(messages, key=lambda d: get_datetime(d.date_sent or d.creation))
+
+	buckets = []
+	for message in messages:
+		date_sent = get_datetime(message.date_sent or message.creation)
+		if not buckets or date_sent - buckets[-1][0] > 2 * margin:
+			buckets.append([date_sent, date_sent, []])
+
+		buckets[-1][1] = date_sent
+		buckets[-1][2].append(message)
+
+	return [(first_date_sent - margin, last_date_sent + margin, bucket) for first_date_sent, last_date_sent, bucket in buckets]
+
+
+def convert_system_timezone_to_utc(value):
+	return get_datetime(value).replace(tzinfo=ZoneInfo(get_system_timezone())).astimezone(timezone.utc)
 
 
 @frappe.task(queue="long")
@@ -1001,19 +2018,65 @@ def reconcile_message_status(message_name, auto_commit=True):
 		)
 
 
-def get_messages_pending_status_reconciliation(limit):
+def get_messages_pending_status_reconciliation(limit, whatsapp_providers=None):
 	"""
-	Fetch WhatsApp messages with status 'Sent' or 'Queued' and that haven't received delivery confirmation
+	Fetch WhatsApp messages with status 'Sent' or 'Queued' that haven't received delivery confirmation
+	and are due for a status check, the longest waiting first.
+	Messages are checked less often as they get older and are given up after the cutoff
 	"""
-	return frappe.db.sql_list("""
-		SELECT name
+	now = now_datetime()
+	values = {
+		"limit": limit,
+		"whatsapp_providers": whatsapp_providers,
+		"cutoff": add_to_date(now, days=-RECONCILIATION_CUTOFF_DAYS),
+	}
+
+	due_conditions = []
+	for i, interval in enumerate(RECONCILIATION_INTERVALS):
+		values[f"due_{i}"] = add_to_date(now, minutes=-interval)
+		due_conditions.append(f"WHEN {i} THEN %(due_{i})s")
+
+	provider_condition = ""
+	if whatsapp_providers:
+		provider_condition = "AND whatsapp_provider IN %(whatsapp_providers)s"
+
+	return frappe.db.sql(f"""
+		SELECT name, id, from_, `to`, status, whatsapp_provider, date_sent, creation
 		FROM `tabWhatsApp Message`
 		WHERE status IN ('Sent', 'Queued')
 			AND sent_received = 'Sent'
 			AND id IS NOT NULL
-		ORDER BY creation DESC
-		LIMIT %s
-	""", (limit,), as_dict=True)
+			AND creation >= %(cutoff)s
+			AND COALESCE(status_checked_at, date_sent, creation) <= (
+				CASE LEAST(IFNULL(status_check_count, 0), {len(RECONCILIATION_INTERVALS) - 1})
+				{" ".join(due_conditions)}
+				END
+			)
+			{provider_condition}
+		ORDER BY COALESCE(status_checked_at, date_sent, creation)
+		LIMIT %(limit)s
+	""", values, as_dict=True)
+
+
+def mark_message_statuses_checked(message_names):
+	frappe.db.sql("""
+		UPDATE `tabWhatsApp Message`
+		SET status_checked_at = %s, status_check_count = IFNULL(status_check_count, 0) + 1
+		WHERE name IN %s
+	""", (now_datetime(), message_names))
+
+
+def get_reconciliation_limit(whatsapp_providers):
+	"""Size a reconciliation run to the rate budget of the providers"""
+	limit = 0
+	for whatsapp_provider in whatsapp_providers:
+		messages_per_second = get_send_rate_limit(whatsapp_provider)
+		if messages_per_second:
+			limit += int(messages_per_second * RECONCILIATION_BUDGET_SECONDS)
+		else:
+			limit += RECONCILIATION_DEFAULT_LIMIT
+
+	return min(limit, RECONCILIATION_MAX_LIMIT)
 
 
 @frappe.whitelist(allow_guest=True)
@@ -1065,6 +2128,18 @@ def serve_whatsapp_media(message_doc):
 			download_name=media_filename,
 		)
 
+	elif attachment.get("print_format_attachment") == 1 and is_pdf_cache_enabled():
+		from werkzeug.utils import send_file
+
+		# Repeated fetches by providers and link previews are served without rendering again
+		pdf_file = get_cached_print_pdf(attachment, lambda: message_doc.get_print_format_file(attachment))
+		return send_file(
+			pdf_file,
+			environ=frappe.local.request.environ,
+			mimetype="application/pdf",
+			download_name=get_print_pdf_file_name(attachment),
+		)
+
 	elif attachment.get("print_format_attachment") == 1:
 		print_format_file = message_doc.get_print_format_file(attachment)
 		frappe.local.response.filename = print_format_file["fname"]
@@ -1077,4 +2152,8 @@ def serve_whatsapp_media(message_doc):
 def on_doctype_update():
 	frappe.db.add_index('WhatsApp Message', ('status', 'priority', 'creation'), 'index_bulk_flush')
 	frappe.db.add_index('WhatsApp Message', ('incoming_media_status', 'priority', 'creation'), 'index_incoming_media')
+	frappe.db.add_index('WhatsApp Message', ('status', 'next_retry_at'), 'index_retry_due')
+	frappe.db.add_index('WhatsApp Message', ('incoming_media_status', 'next_retry_at'), 'index_incoming_media_retry_due')
 	frappe.db.add_index('WhatsApp Message', ('`to`', 'status', 'date_sent'), 'index_indirect_reply')
+	frappe.db.add_index('WhatsApp Message', ('status', 'lease_expires_at'), 'index_lease_expiry')
+	frappe.db.add_index('WhatsApp Message', ('reference_doctype', 'reference_name'), 'index_reference')
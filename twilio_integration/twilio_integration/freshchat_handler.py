@@ -0,0 +1,91 @@
+import frappe
+from frappe import _
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin
+import threading
+import requests
+from .provider_errors import WhatsAppConfigurationError
+
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+
+class Freshchat:
+	"""Freshchat connector over a pooled requests Session.
+	"""
+	def __init__(self, settings):
+		"""
+		:param settings: `Freshchat Settings` doctype
+		"""
+		self.settings_modified = settings.modified
+		self.api_endpoint = settings.api_endpoint
+		self.channel_id = settings.channel_id
+		self.namespace = settings.namespace
+
+		self.session = requests.Session()
+		self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=20))
+		self.session.headers.update({
+			"Authorization": f"Bearer {settings.api_key}",
+			"Content-Type": "application/json",
+		})
+
+	def send_outbound_message(self, payload):
+		response = self.session.post(
+			urljoin(self.api_endpoint, "/v2/outbound-messages/whatsapp"),
+			json=payload,
+			timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+		)
+		response.raise_for_status()
+		return response.json()
+
+	def get_outbound_messages(self, request_id):
+		response = self.session.get(
+			urljoin(self.api_endpoint, "/v2/outbound-messages"),
+			params={"request_id": request_id},
+			timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+		)
+		response.raise_for_status()
+		return response.json()
+
+	def close(self):
+		self.session.close()
+
+
+_freshchat_client_pool = {}
+_freshchat_client_pool_lock = threading.Lock()
+
+
+def get_freshchat_client():
+	"""Get the process wide Freshchat client of the current site.
+
+	Settings are read and the HTTP session is created once per worker process. The client is rebuilt
+	when `Freshchat Settings` are modified.
+	"""
+	if not frappe.get_cached_value("Freshchat Settings", None, "enabled"):
+		frappe.throw(_("Please enable Freshchat Settings before sending WhatsApp messages"), exc=WhatsAppConfigurationError)
+
+	site = frappe.local.site
+	settings_modified = frappe.get_cached_value("Freshchat Settings", None, "modified")
+
+	client = _freshchat_client_pool.get(site)
+	if client and client.settings_modified == settings_modified:
+		return client
+
+	with _freshchat_client_pool_lock:
+		client = _freshchat_client_pool.get(site)
+		if not client or client.settings_modified != settings_modified:
+			client = Freshchat(frappe.get_cached_doc("Freshchat Settings"))
+			_freshchat_client_pool[site] = client
+
+	return client
+
+
+def clear_freshchat_client_pool(site=None):
+	"""Drop the pooled Freshchat client of the site so that it is rebuilt with the latest settings.
+	"""
+	with _freshchat_client_pool_lock:
+		client = _freshchat_client_pool.pop(site or frappe.local.site, None)
+
+	if client:
+		client.close()
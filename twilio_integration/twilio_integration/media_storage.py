@@ -0,0 +1,101 @@
+import frappe
+from frappe import _
+import hashlib
+import os
+import tempfile
+
+
+MEDIA_FOLDER = "whatsapp_media"
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+
+class MediaTooLargeError(frappe.ValidationError):
+	pass
+
+
+def store_media_stream(chunks, extension=None, max_size=None):
+	"""Store media in private files under its SHA-256 digest, computed while the chunks are written.
+	Identical media is stored once on disk and shared by all File records pointing to it.
+	Returns the file url, size and content hash. The content hash is MD5 like that of other File records.
+	"""
+	media_path = frappe.get_site_path("private", "files", MEDIA_FOLDER)
+	os.makedirs(media_path, exist_ok=True)
+
+	digest = hashlib.sha256()
+	content_digest = hashlib.md5()
+	file_size = 0
+
+	# Written to a temporary file first so that a partial write never shows up as a stored blob
+	temp_file = tempfile.NamedTemporaryFile(dir=media_path, prefix=".", suffix=".part", delete=False)
+	try:
+		with temp_file:
+			for chunk in chunks:
+				file_size += len(chunk)
+				if max_size and file_size > max_size:
+					raise_media_too_large(max_size)
+
+				digest.update(chunk)
+				content_digest.update(chunk)
+				temp_file.write(chunk)
+
+		file_url = get_media_file_url(digest.hexdigest(), extension)
+		file_path = frappe.get_site_path(file_url.lstrip("/"))
+
+		if os.path.exists(file_path):
+			os.remove(temp_file.name)
+		else:
+			os.makedirs(os.path.dirname(file_path), exist_ok=True)
+			os.replace(temp_file.name, file_path)
+
+	except Exception:
+		if os.path.exists(temp_file.name):
+			os.remove(temp_file.name)
+		raise
+
+	return frappe._dict({
+		"file_url": file_url,
+		"file_size": file_size,
+		"content_hash": content_digest.hexdigest(),
+	})
+
+
+def store_media_content(content, extension=None):
+	if isinstance(content, str):
+		content = content.encode()
+
+	return store_media_stream(
+		(content[i:i + MEDIA_CHUNK_SIZE] for i in range(0, len(content), MEDIA_CHUNK_SIZE)),
+		extension=extension,
+	)
+
+
+def make_media_file(stored_media, file_name, attached_to_doctype=None, attached_to_name=None):
+	"""Create a private File record for stored media without reading it.
+	File.insert would read the blob back through save_file and store a copy of it under a new name.
+	"""
+	file = frappe.new_doc("File")
+	file.update({
+		"file_name": file_name,
+		"file_url": stored_media.file_url,
+		"file_size": stored_media.file_size,
+		"content_hash": stored_media.content_hash,
+		"is_private": 1,
+		"folder": "Home/Attachments" if attached_to_doctype else "Home",
+		"attached_to_doctype": attached_to_doctype,
+		"attached_to_name": attached_to_name,
+	})
+	file.name = frappe.generate_hash(length=10)
+	file.set_user_and_timestamp()
+	file.db_insert()
+	return file
+
+
+def get_media_file_url(digest, extension=None):
+	return f"/private/files/{MEDIA_FOLDER}/{digest[:2]}/{digest}{extension or ''}"
+
+
+def raise_media_too_large(max_size):
+	frappe.throw(
+		_("Media is larger than the maximum allowed size of {0} MB").format(max_size // (1024 * 1024)),
+		exc=MediaTooLargeError,
+	)
@@ -0,0 +1,170 @@
+import frappe
+from frappe.utils import cint, cstr
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+
+
+PDF_CACHE_FOLDER = "whatsapp_pdf_cache"
+EVICTION_BATCH_SIZE = 100
+
+# KEYS: index, sizes, total size
+# ARGV: entry, access time
+touch_entry_script = """
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+	redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+	return 1
+end
+return 0
+"""
+
+# KEYS: index, sizes, total size
+# ARGV: entry, access time, size
+add_entry_script = """
+local previous_size = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or '0')
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+return redis.call('INCRBY', KEYS[3], tonumber(ARGV[3]) - previous_size)
+"""
+
+# KEYS: index, sizes, total size
+# ARGV: entry
+# Returns 1 only to the caller that removed the entry, so that its file is deleted once
+remove_entry_script = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+	return 0
+end
+local size = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or '0')
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('DECRBY', KEYS[3], size)
+return 1
+"""
+
+
+def get_pdf_cache_settings():
+	return frappe._dict({
+		"max_size": cint(frappe.get_cached_value("WhatsApp Settings", None, "pdf_cache_max_size")) * 1024 * 1024,
+		"ttl": cint(frappe.get_cached_value("WhatsApp Settings", None, "pdf_cache_ttl")) * 60 * 60,
+	})
+
+
+def is_pdf_cache_enabled():
+	return bool(get_pdf_cache_settings().max_size)
+
+
+def get_cached_print_pdf(attachment, render):
+	"""Rendered PDF of a print format attachment as a file object, `render` is only called on a cache miss.
+	Entries are keyed by the document's modified timestamp, so they do not outlive changes to the document.
+	"""
+	entry = get_pdf_cache_entry(attachment)
+	file_path = get_pdf_cache_path(entry)
+
+	# The file is opened before returning, so that eviction by a concurrent request cannot remove it from under the caller
+	if touch_pdf_cache_entry(entry):
+		try:
+			return open(file_path, "rb")
+		except FileNotFoundError:
+			pass
+
+	print_format_file = render()
+	content = print_format_file["fcontent"]
+
+	max_size = get_pdf_cache_settings().max_size
+	if len(content) > max_size:
+		return io.BytesIO(content)
+
+	write_pdf_cache_file(file_path, content)
+	pdf_file = open(file_path, "rb")
+
+	total_size = frappe.cache().eval(add_entry_script, 3, *get_pdf_cache_keys(), entry, time.time(), len(content))
+	if cint(total_size) > max_size:
+		evict_pdf_cache()
+
+	return pdf_file
+
+
+def write_pdf_cache_file(file_path, content):
+	"""Write to a temporary file first so that a concurrent request never streams a partial PDF"""
+	os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+	temp_file = tempfile.NamedTemporaryFile(dir=os.path.dirname(file_path), prefix=".", suffix=".part", delete=False)
+	try:
+		with temp_file:
+			temp_file.write(content)
+		os.replace(temp_file.name, file_path)
+	except Exception:
+		if os.path.exists(temp_file.name):
+			os.remove(temp_file.name)
+		raise
+
+
+def get_pdf_cache_entry(attachment):
+	modified = frappe.db.get_value(attachment.get("doctype"), attachment.get("name"), "modified")
+	key = {
+		"doctype": attachment.get("doctype"),
+		"name": attachment.get("name"),
+		"print_format": attachment.get("print_format"),
+		"letterhead": attachment.get("letterhead"),
+		"print_letterhead": attachment.get("print_letterhead"),
+		"lang": attachment.get("lang"),
+		"modified": cstr(modified),
+	}
+	return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def get_print_pdf_file_name(attachment):
+	file_name = cstr(attachment.get("file_name") or attachment.get("name")).replace(" ", "").replace("/", "-")
+	return f"{file_name}.pdf"
+
+
+def touch_pdf_cache_entry(entry):
+	return cint(frappe.cache().eval(touch_entry_script, 3, *get_pdf_cache_keys(), entry, time.time()))
+
+
+def evict_pdf_cache():
+	"""Remove entries not used within the TTL, then the least recently used entries until the cache fits its size"""
+	settings = get_pdf_cache_settings()
+	cache = frappe.cache()
+	index_key, sizes_key, total_size_key = get_pdf_cache_keys()
+
+	if settings.ttl:
+		for entry in cache.zrangebyscore(index_key, "-inf", time.time() - settings.ttl):
+			remove_pdf_cache_entry(frappe.safe_decode(entry))
+
+	while cint(cache.get(total_size_key)) > settings.max_size:
+		entries = cache.zrange(index_key, 0, EVICTION_BATCH_SIZE - 1)
+		if not entries:
+			break
+
+		for entry in entries:
+			remove_pdf_cache_entry(frappe.safe_decode(entry))
+			if cint(cache.get(total_size_key)) <= settings.max_size:
+				break
+
+
+def remove_pdf_cache_entry(entry):
+	if cint(frappe.cache().eval(remove_entry_script, 3, *get_pdf_cache_keys(), entry)):
+		file_path = get_pdf_cache_path(entry)
+		if os.path.exists(file_path):
+			os.remove(file_path)
+
+
+def clear_expired_pdf_cache():
+	"""Called daily via scheduler"""
+	if is_pdf_cache_enabled():
+		evict_pdf_cache()
+
+
+def get_pdf_cache_path(entry):
+	return frappe.get_site_path("private", PDF_CACHE_FOLDER, entry[:2], f"{entry}.pdf")
+
+
+def get_pdf_cache_keys():
+	return [
+		frappe.cache().make_key("whatsapp_pdf_cache:index"),
+		frappe.cache().make_key("whatsapp_pdf_cache:sizes"),
+		frappe.cache().make_key("whatsapp_pdf_cache:total_size"),
+	]
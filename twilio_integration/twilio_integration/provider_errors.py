@@ -0,0 +1,100 @@
+import frappe
+from frappe.utils import cint
+from twilio.base.exceptions import TwilioRestException
+import requests
+
+
+# Error classes of Twilio error codes for which the same message will never be accepted
+# https://www.twilio.com/docs/api/errors
+permanent_twilio_error_codes = {
+	21211: "invalid_recipient",  # Invalid 'To' Phone Number
+	21212: "invalid_sender",  # Invalid 'From' Phone Number
+	21408: "region_not_enabled",  # Permission to send an SMS/WhatsApp has not been enabled for the region
+	21610: "recipient_unsubscribed",  # Attempt to send to unsubscribed recipient
+	21614: "invalid_recipient",  # 'To' number is not a valid mobile number
+	21617: "invalid_content",  # Concatenated message body exceeds the 1600 character limit
+	21656: "invalid_content",  # Invalid Content Variables
+	63003: "invalid_recipient",  # Channel could not find To address
+	63005: "invalid_content",  # Channel did not accept given content
+	63013: "policy_violation",  # Channel policy violation
+	63016: "outside_session_window",  # Freeform message outside the allowed window
+	63024: "invalid_recipient",  # Invalid message recipient
+}
+
+
+class ProviderError(frappe._dict):
+	"""Classification of an error raised while calling a WhatsApp provider"""
+	pass
+
+
+class WhatsAppConfigurationError(frappe.ValidationError):
+	"""Settings needed to send messages are missing or disabled, sending can succeed once they are fixed"""
+	pass
+
+
+def classify_provider_error(e):
+	"""Classify an exception into an error class and whether the call should be retried.
+	"""
+	if isinstance(e, TwilioRestException):
+		if e.code in permanent_twilio_error_codes:
+			return ProviderError(error_class=permanent_twilio_error_codes[e.code], retryable=False)
+		return classify_http_status(e.status)
+
+	if isinstance(e, requests.HTTPError) and e.response is not None:
+		return classify_http_status(e.response.status_code)
+
+	if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+		return ProviderError(error_class="network", retryable=True)
+
+	if isinstance(e, WhatsAppConfigurationError):
+		return ProviderError(error_class="configuration", retryable=True)
+
+	if isinstance(e, frappe.ValidationError):
+		return ProviderError(error_class="validation", retryable=False)
+
+	return ProviderError(error_class="unknown", retryable=True)
+
+
+def classify_http_status(status_code):
+	status_code = cint(status_code)
+
+	if status_code == 429:
+		return ProviderError(error_class="rate_limited", retryable=True)
+	if status_code == 408 or status_code >= 500:
+		return ProviderError(error_class="provider_unavailable", retryable=True)
+	if status_code in (401, 403):
+		# Credentials can be fixed in settings, the message itself is fine
+		return ProviderError(error_class="authentication", retryable=True)
+	if 400 <= status_code < 500:
+		return ProviderError(error_class="invalid_request", retryable=False)
+
+	return ProviderError(error_class="unknown", retryable=True)
+
+
+def record_provider_error(whatsapp_provider, error):
+	frappe.cache().eval(
+		"return redis.call('HINCRBY', KEYS[1], ARGV[1], 1)",
+		1,
+		get_error_counts_key(),
+		f"{whatsapp_provider}:{error.error_class}",
+	)
+
+
+@frappe.whitelist()
+def get_provider_error_counts():
+	"""Count of send errors by provider and error class"""
+	frappe.only_for("System Manager")
+
+	error_counts = frappe.cache().eval("return redis.call('HGETALL', KEYS[1])", 1, get_error_counts_key())
+	error_counts = [frappe.safe_decode(d) for d in error_counts]
+
+	out = {}
+	for key, count in zip(error_counts[0::2], error_counts[1::2]):
+		whatsapp_provider, error_class = key.split(":", 1)
+		out.setdefault(whatsapp_provider, {})[error_class] = cint(count)
+
+	return out
+
+
+def get_error_counts_key():
+	return frappe.cache().make_key("whatsapp_provider_error_counts")
@@ -0,0 +1,89 @@
+import frappe
+from frappe.utils import flt
+import time
+
+
+# Refill the bucket by elapsed time and take a token if available.
+# Returns the seconds to wait before a token becomes available, as a string to keep the fraction.
+token_bucket_script = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+
+local redis_time = redis.call('TIME')
+local now = tonumber(redis_time[1]) + tonumber(redis_time[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'timestamp')
+local tokens = tonumber(bucket[1]) or capacity
+local timestamp = tonumber(bucket[2]) or now
+
+tokens = math.min(capacity, tokens + math.max(0, now - timestamp) * rate)
+
+local wait = 0
+if tokens >= 1 then
+	tokens = tokens - 1
+else
+	wait = (1 - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'timestamp', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+	"""Token bucket rate limiter stored in Redis and shared by all workers of the site.
+	"""
+	def __init__(self, key, rate, capacity=None):
+		"""
+		:param key: unique name of the bucket
+		:param rate: tokens added per second
+		:param capacity: maximum tokens that can be consumed in a burst, defaults to `rate`
+		"""
+		self.key = frappe.cache().make_key(f"token_bucket:{key}")
+		self.rate = flt(rate)
+		self.capacity = max(flt(capacity or rate), 1)
+
+	def try_acquire(self):
+		"""Take a token if available. Returns 0 on success or the seconds to wait for the next token.
+		"""
+		wait = frappe.cache().eval(token_bucket_script, 1, self.key, self.rate, self.capacity)
+		return flt(frappe.safe_decode(wait))
+
+	def acquire(self, timeout=60):
+		"""Wait for a token for upto `timeout` seconds. Returns True if a token was taken.
+		"""
+		deadline = time.monotonic() + timeout
+		while True:
+			wait = self.try_acquire()
+			if not wait:
+				return True
+
+			if time.monotonic() + wait > deadline:
+				return False
+
+			time.sleep(wait)
+
+
+def get_send_rate_limit(whatsapp_provider):
+	fieldname = {
+		"Twilio": "twilio_messages_per_second",
+		"Freshchat": "freshchat_messages_per_second",
+	}.get(whatsapp_provider)
+
+	if not fieldname:
+		return 0
+
+	return flt(frappe.get_cached_value("WhatsApp Settings", None, fieldname))
+
+
+def acquire_send_token(whatsapp_provider, sender, timeout=60):
+	"""Wait for the rate limit of the sender number of the WhatsApp Provider.
+	Returns False if a token could not be taken within `timeout` seconds.
+	"""
+	rate = get_send_rate_limit(whatsapp_provider)
+	if rate <= 0:
+		return True
+
+	return TokenBucket(f"whatsapp_send:{whatsapp_provider}:{sender}", rate).acquire(timeout=timeout)
@@ -0,0 +1,102 @@
+import frappe
+from frappe.utils import cint
+import json
+import time
+
+
+STATUS_BUFFER = "whatsapp_status_buffer"
+STATUS_BUFFER_WINDOW = "whatsapp_status_buffer_window"
+STATUS_BUFFER_PROCESSING = "whatsapp_status_buffer_processing"
+
+# Buffered status updates are only dropped if the scheduler has not flushed them for this long
+STATUS_BUFFER_EXPIRY = 60 * 60
+
+# Keep the status update of a message in the buffer only if it outranks the buffered one
+buffer_status_update_script = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if current then
+	local rank = tonumber(string.match(current, '^(%d+)|'))
+	if rank >= tonumber(ARGV[2]) then
+		return 0
+	end
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2] .. '|' .. ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+# KEYS: buffer, processing
+# ARGV: expiry
+# Move buffered status updates to the processing hash, which keeps them until they are applied.
+# Updates left there by a failed flush are merged with the new ones and applied again.
+take_status_updates_script = """
+local items = redis.call('HGETALL', KEYS[1])
+for i = 1, #items, 2 do
+	local current = redis.call('HGET', KEYS[2], items[i])
+	if not current or tonumber(string.match(current, '^(%d+)|')) < tonumber(string.match(items[i + 1], '^(%d+)|')) then
+		redis.call('HSET', KEYS[2], items[i], items[i + 1])
+	end
+end
+redis.call('DEL', KEYS[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return redis.call('HGETALL', KEYS[2])
+"""
+
+# KEYS: processing
+# ARGV: message id, status update pairs
+# Remove applied status updates, unless a newer one was merged in by another flush meanwhile
+remove_status_updates_script = """
+for i = 1, #ARGV, 2 do
+	if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+		redis.call('HDEL', KEYS[1], ARGV[i])
+	end
+end
+return 1
+"""
+
+
+def get_status_update_coalescing_window():
+	return cint(frappe.get_cached_value("WhatsApp Settings", None, "status_update_coalescing_window"))
+
+
+def buffer_status_update(status_update, rank, window):
+	"""Buffer a status update of a message and start a window if one is not open already"""
+	cache = frappe.cache()
+	cache.eval(
+		buffer_status_update_script, 1, cache.make_key(STATUS_BUFFER),
+		status_update.id, rank, json.dumps(status_update), STATUS_BUFFER_EXPIRY,
+	)
+
+	# The end of the window is set by the first status update buffered in it
+	cache.set(cache.make_key(STATUS_BUFFER_WINDOW), time.time() + window, nx=True, ex=STATUS_BUFFER_EXPIRY)
+
+
+def flush_status_buffer():
+	"""Apply the latest buffered status update of each message if the current window has passed"""
+	from twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message import apply_status_updates
+
+	cache = frappe.cache()
+
+	window_end = cache.get(cache.make_key(STATUS_BUFFER_WINDOW))
+	if window_end and float(window_end) > time.time():
+		return
+
+	# Status updates received from now on are flushed in the next window
+	cache.delete(cache.make_key(STATUS_BUFFER_WINDOW))
+	processing_key = cache.make_key(STATUS_BUFFER_PROCESSING)
+	items = cache.eval(
+		take_status_updates_script, 2, cache.make_key(STATUS_BUFFER), processing_key, STATUS_BUFFER_EXPIRY
+	)
+
+	status_updates = []
+	for value in items[1::2]:
+		rank, status_update = frappe.safe_decode(value).split("|", 1)
+		status_updates.append(frappe._dict(json.loads(status_update)))
+
+	if status_updates:
+		frappe.set_user("Administrator")
+		apply_status_updates(status_updates, auto_commit=True)
+
+	# Only removed once applied, so that a failed flush is retried on the next tick
+	if items:
+		cache.eval(remove_status_updates_script, 1, processing_key, *items)
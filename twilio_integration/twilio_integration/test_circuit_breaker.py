@@ -0,0 +1,71 @@
+# Copyright (c) 2026, Frappe and Contributors
+# See license.txt
+
+import frappe
+import time
+import unittest
+
+from twilio_integration.twilio_integration.circuit_breaker import CircuitBreaker
+
+
+class TestCircuitBreaker(unittest.TestCase):
+	def setUp(self):
+		self.circuit_breaker = CircuitBreaker(
+			f"test:{frappe.generate_hash(length=8)}",
+			failure_threshold=2,
+			reset_timeout=1,
+		)
+
+	def tearDown(self):
+		frappe.cache().delete(*self.circuit_breaker.keys)
+
+	def test_opens_after_consecutive_failures(self):
+		self.assertTrue(self.circuit_breaker.allow_request())
+
+		self.circuit_breaker.record_failure()
+		self.assertFalse(self.circuit_breaker.is_open())
+		self.assertTrue(self.circuit_breaker.allow_request())
+
+		self.circuit_breaker.record_failure()
+		self.assertTrue(self.circuit_breaker.is_open())
+		self.assertFalse(self.circuit_breaker.allow_request())
+
+	def test_success_resets_failures(self):
+		self.circuit_breaker.record_failure()
+		self.circuit_breaker.record_success()
+		self.circuit_breaker.record_failure()
+
+		self.assertFalse(self.circuit_breaker.is_open())
+		self.assertTrue(self.circuit_breaker.allow_request())
+
+	def test_half_open_allows_one_probe(self):
+		self.circuit_breaker.record_failure()
+		self.circuit_breaker.record_failure()
+		time.sleep(1.1)
+
+		self.assertFalse(self.circuit_breaker.is_open())
+		self.assertTrue(self.circuit_breaker.allow_request())
+		self.assertFalse(self.circuit_breaker.allow_request())
+
+		self.circuit_breaker.record_success()
+		self.assertTrue(self.circuit_breaker.allow_request())
+		self.assertTrue(self.circuit_breaker.allow_request())
+
+	def test_failed_probe_opens_again(self):
+		self.circuit_breaker.record_failure()
+		self.circuit_breaker.record_failure()
+		time.sleep(1.1)
+
+		self.assertTrue(self.circuit_breaker.allow_request())
+		self.circuit_breaker.record_failure()
+
+		self.assertTrue(self.circuit_breaker.is_open())
+		self.assertFalse(self.circuit_breaker.allow_request())
+
+	def test_disabled_without_threshold(self):
+		circuit_breaker = CircuitBreaker(f"test:{frappe.generate_hash(length=8)}", failure_threshold=0)
+		for i in range(10):
+			circuit_breaker.record_failure()
+
+		self.assertFalse(circuit_breaker.is_open())
+		self.assertTrue(circuit_breaker.allow_request())
@@ -0,0 +1,84 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See license.txt
+
+import frappe
+import hashlib
+import os
+import unittest
+
+from twilio_integration.twilio_integration.media_storage import (
+	MEDIA_FOLDER,
+	MediaTooLargeError,
+	make_media_file,
+	store_media_content,
+	store_media_stream,
+)
+
+
+class TestMediaStorage(unittest.TestCase):
+	def setUp(self):
+		self.stored_files = []
+
+	def tearDown(self):
+		frappe.db.rollback()
+		for file_url in self.stored_files:
+			file_path = frappe.get_site_path(file_url.lstrip("/"))
+			if os.path.exists(file_path):
+				os.remove(file_path)
+
+	def store(self, chunks, **kwargs):
+		stored_media = store_media_stream(chunks, extension=".bin", **kwargs)
+		self.stored_files.append(stored_media.file_url)
+		return stored_media
+
+	def test_media_within_size_limit(self):
+		content = frappe.generate_hash(length=16).encode()
+
+		stored_media = self.store([content[:8], content[8:]], max_size=len(content))
+
+		self.assertEqual(stored_media.file_size, len(content))
+		with open(frappe.get_site_path(stored_media.file_url.lstrip("/")), "rb") as f:
+			self.assertEqual(f.read(), content)
+
+	def test_media_over_size_limit(self):
+		def chunks():
+			yield b"x" * 8
+			yield b"x" * 8
+			raise AssertionError("Media should not be read past the size limit")
+
+		self.assertRaises(MediaTooLargeError, store_media_stream, chunks(), extension=".bin", max_size=10)
+
+		# The partial write is removed
+		media_path = frappe.get_site_path("private", "files", MEDIA_FOLDER)
+		self.assertFalse([f for f in os.listdir(media_path) if f.endswith(".part")])
+
+	def test_identical_media_is_stored_once(self):
+		content = frappe.generate_hash(length=64).encode()
+
+		stored_media = self.store([content])
+		self.assertEqual(self.store([content[:32], content[32:]]).file_url, stored_media.file_url)
+
+		# The path is keyed by SHA-256, the content hash is MD5 like that of other File records
+		self.assertIn(hashlib.sha256(content).hexdigest(), stored_media.file_url)
+		self.assertEqual(stored_media.content_hash, hashlib.md5(content).hexdigest())
+
+	def test_different_media_is_stored_separately(self):
+		stored_media = self.store([b"first"])
+		other_stored_media = store_media_content(b"second", extension=".bin")
+		self.stored_files.append(other_stored_media.file_url)
+
+		self.assertNotEqual(stored_media.file_url, other_stored_media.file_url)
+
+	def test_file_points_to_stored_media(self):
+		content = frappe.generate_hash(length=64).encode()
+		stored_media = self.store([content])
+		file_path = frappe.get_site_path(stored_media.file_url.lstrip("/"))
+
+		files = [make_media_file(stored_media, "test.bin") for i in range(2)]
+
+		for file in files:
+			self.assertEqual(frappe.db.get_value("File", file.name, "file_url"), stored_media.file_url)
+			self.assertEqual(file.get_content(), content)
+
+		with open(file_path, "rb") as f:
+			self.assertEqual(f.read(), content)
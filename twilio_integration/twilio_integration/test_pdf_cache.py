@@ -0,0 +1,85 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See license.txt
+
+import frappe
+import os
+import unittest
+from unittest.mock import patch
+
+from twilio_integration.twilio_integration.pdf_cache import (
+	get_cached_print_pdf,
+	get_pdf_cache_entry,
+	get_pdf_cache_path,
+	remove_pdf_cache_entry,
+)
+
+
+class TestPDFCache(unittest.TestCase):
+	def setUp(self):
+		self.attachments = []
+		self.render_count = 0
+
+		settings_patcher = patch(
+			"twilio_integration.twilio_integration.pdf_cache.get_pdf_cache_settings",
+			return_value=frappe._dict(max_size=10, ttl=0),
+		)
+		settings_patcher.start()
+		self.addCleanup(settings_patcher.stop)
+
+	def tearDown(self):
+		for attachment in self.attachments:
+			remove_pdf_cache_entry(get_pdf_cache_entry(attachment))
+
+	def make_attachment(self):
+		attachment = frappe._dict({
+			"doctype": "User",
+			"name": "Administrator",
+			"print_format": f"test-{frappe.generate_hash(length=8)}",
+		})
+		self.attachments.append(attachment)
+		return attachment
+
+	def get_pdf(self, attachment, content):
+		def render():
+			self.render_count += 1
+			return {"fname": "test.pdf", "fcontent": content}
+
+		with get_cached_print_pdf(attachment, render) as pdf_file:
+			return pdf_file.read()
+
+	def test_cache_hit_and_miss(self):
+		attachment = self.make_attachment()
+
+		self.assertEqual(self.get_pdf(attachment, b"first"), b"first")
+		self.assertEqual(self.get_pdf(attachment, b"other"), b"first")
+		self.assertEqual(self.render_count, 1)
+
+		self.assertEqual(self.get_pdf(self.make_attachment(), b"second"), b"second")
+		self.assertEqual(self.render_count, 2)
+
+	def test_missing_file_is_rendered_again(self):
+		attachment = self.make_attachment()
+		self.get_pdf(attachment, b"first")
+		os.remove(get_pdf_cache_path(get_pdf_cache_entry(attachment)))
+
+		self.assertEqual(self.get_pdf(attachment, b"first"), b"first")
+		self.assertEqual(self.render_count, 2)
+
+	def test_pdf_larger_than_cache_is_not_cached(self):
+		attachment = self.make_attachment()
+
+		self.assertEqual(self.get_pdf(attachment, b"x" * 20), b"x" * 20)
+		self.assertFalse(os.path.exists(get_pdf_cache_path(get_pdf_cache_entry(attachment))))
+
+		self.get_pdf(attachment, b"x" * 20)
+		self.assertEqual(self.render_count, 2)
+
+	def test_least_recently_used_pdf_is_evicted(self):
+		first_attachment = self.make_attachment()
+		second_attachment = self.make_attachment()
+
+		self.get_pdf(first_attachment, b"first")
+		self.get_pdf(second_attachment, b"second")
+
+		self.assertFalse(os.path.exists(get_pdf_cache_path(get_pdf_cache_entry(first_attachment))))
+		self.assertTrue(os.path.exists(get_pdf_cache_path(get_pdf_cache_entry(second_attachment))))
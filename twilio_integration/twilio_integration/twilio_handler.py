@@ -1,4 +1,5 @@
 from twilio.rest import Client as TwilioClient
+from twilio.http.http_client import TwilioHttpClient
 from twilio.jwt.access_token import AccessToken
 from twilio.jwt.access_token.grants import VoiceGrant
 from twilio.twiml.voice_response import VoiceResponse, Dial
@@ -6,11 +7,18 @@ from twilio.request_validator import RequestValidator
 
 import frappe
 from frappe import _
+from frappe.utils import cint
 from frappe.utils.password import get_decrypted_password
 from .utils import get_public_url, merge_dicts
+from .provider_errors import WhatsAppConfigurationError
 from functools import wraps
+import threading
 import requests
-import base64
+from requests.adapters import HTTPAdapter
+
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
 
 
 class Twilio:
@@ -111,14 +119,7 @@ class Twilio:
 
 	@classmethod
 	def get_twilio_client(cls):
-		twilio_settings = frappe.get_doc("Twilio Settings")
-		if not twilio_settings.enabled:
-			frappe.throw(_("Please enable twilio settings before sending WhatsApp messages"))
-
-		auth_token = get_decrypted_password("Twilio Settings", "Twilio Settings", 'auth_token')
-		client = TwilioClient(twilio_settings.account_sid, auth_token)
-
-		return client
+		return get_pooled_twilio_connection().client
 
 	@classmethod
 	def get_whatsapp_template(cls, template_sid):
@@ -128,21 +129,16 @@ class Twilio:
 		return template
 
 	@classmethod
-	def download_media_request(cls, media_url):
-		settings = frappe.get_doc("Twilio Settings")
-		if not settings.enabled:
-			frappe.throw(_("Twilio is not enabled"))
-
-		auth_token = get_decrypted_password("Twilio Settings", "Twilio Settings", 'auth_token')
-
-		credentials = f"{settings.account_sid}:{auth_token}"
-		encoded_credentials = base64.b64encode(credentials.encode('utf-8')).decode('utf-8')
-		headers = {
-			'Authorization': f'Basic {encoded_credentials}'
-		}
+	def download_media_request(cls, media_url, stream=False):
+		"""If `stream` is set, the body is read as it is consumed and the response must be closed by the caller"""
+		connection = get_pooled_twilio_connection()
 
-		response = requests.get(media_url, headers=headers)
-		response.raise_for_status()
+		response = connection.media_session.get(media_url, stream=stream, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+		try:
+			response.raise_for_status()
+		except Exception:
+			response.close()
+			raise
 
 		return response
 
@@ -155,6 +151,84 @@ class Twilio:
 		message = client.messages(message_id).fetch()
 		return message
 
+	@classmethod
+	def stream_messages(cls, from_, date_sent_after, date_sent_before, limit=None, page_size=1000):
+		"""
+		Iterate over messages sent from a number within a date range, fetching pages lazily
+		"""
+		client = cls.get_twilio_client()
+		return client.messages.stream(
+			from_=from_,
+			date_sent_after=date_sent_after,
+			date_sent_before=date_sent_before,
+			limit=limit,
+			page_size=page_size,
+		)
+
+
+_twilio_connection_pool = {}
+_twilio_connection_pool_lock = threading.Lock()
+
+
+def get_pooled_twilio_connection():
+	"""Get the process wide Twilio connection of the current site.
+
+	Auth token is decrypted and HTTP sessions are created once per worker process and kept alive
+	across messages. The connection is rebuilt when `Twilio Settings` or `WhatsApp Settings` are modified.
+	"""
+	if not frappe.get_cached_value("Twilio Settings", None, "enabled"):
+		frappe.throw(_("Please enable twilio settings before sending WhatsApp messages"), exc=WhatsAppConfigurationError)
+
+	site = frappe.local.site
+	settings_modified = (
+		frappe.get_cached_value("Twilio Settings", None, "modified"),
+		frappe.get_cached_value("WhatsApp Settings", None, "modified"),
+	)
+
+	connection = _twilio_connection_pool.get(site)
+	if connection and connection.settings_modified == settings_modified:
+		return connection
+
+	with _twilio_connection_pool_lock:
+		connection = _twilio_connection_pool.get(site)
+		if not connection or connection.settings_modified != settings_modified:
+			connection = make_twilio_connection(settings_modified)
+			_twilio_connection_pool[site] = connection
+
+	return connection
+
+
+def make_twilio_connection(settings_modified=None):
+	account_sid = frappe.get_cached_value("Twilio Settings", None, "account_sid")
+	auth_token = get_decrypted_password("Twilio Settings", "Twilio Settings", 'auth_token')
+
+	media_session = requests.Session()
+	media_session.auth = (account_sid, auth_token)
+
+	# Concurrent downloads wait for a free connection instead of opening more connections to a host
+	connections_per_host = cint(frappe.get_cached_value("WhatsApp Settings", None, "media_download_connections_per_host")) or 4
+	media_adapter = HTTPAdapter(pool_maxsize=connections_per_host, pool_block=True)
+	media_session.mount("https://", media_adapter)
+	media_session.mount("http://", media_adapter)
+
+	return frappe._dict({
+		"settings_modified": settings_modified,
+		# TwilioHttpClient only takes a single timeout, used for both connecting and reading
+		"client": TwilioClient(account_sid, auth_token, http_client=TwilioHttpClient(pool_connections=True, timeout=READ_TIMEOUT)),
+		"media_session": media_session,
+		"validator": RequestValidator(auth_token),
+	})
+
+
+def clear_twilio_connection_pool(site=None):
+	"""Drop the pooled Twilio connection of the site so that it is rebuilt with the latest settings.
+	"""
+	with _twilio_connection_pool_lock:
+		connection = _twilio_connection_pool.pop(site or frappe.local.site, None)
+
+	if connection:
+		connection.media_session.close()
+
 
 class IncomingCall:
 	def __init__(self, from_number, to_number, meta=None):
@@ -273,13 +347,11 @@ def validate_twilio_request(f):
 	"""Validates that incoming requests genuinely originated from Twilio"""
 	@wraps(f)
 	def decorated_function(*args, **kwargs):
-		twilio_settings = frappe.get_doc("Twilio Settings")
-		if not twilio_settings.enabled:
+		if not frappe.get_cached_value("Twilio Settings", None, "enabled"):
 			frappe.throw(_("Twilio is not enabled"), exc=frappe.PermissionError)
 
-		auth_token = get_decrypted_password("Twilio Settings", "Twilio Settings", 'auth_token')
-
-		validator = RequestValidator(auth_token)
+		# Validator is kept with the pooled connection to avoid decrypting the auth token on every request
+		validator = get_pooled_twilio_connection().validator
 
 		request_valid = validator.validate(
 			frappe.request.url,
@@ -1,6 +1,8 @@
 from pyngrok import ngrok
 import frappe
-from frappe.utils import get_url
+from frappe.utils import cint, get_url
+import queue
+import threading
 
 
 def get_public_url(path: str=None, use_ngrok: bool=False):
@@ -26,3 +28,56 @@ def merge_dicts(d1: dict, d2: dict):
 	... {'name1': {'age': 20, 'phone': '+xxx'}, 'name2': {'age': 30, 'phone': '+yyy'}}
 	"""
 	return {k:{**v, **d2.get(k, {})} for k, v in d1.items()}
+
+
+def cache_key_exists(key):
+	"""Check if a key built with `make_key` exists. `RedisWrapper.exists` would prefix the key again."""
+	return cint(frappe.cache().eval("return redis.call('EXISTS', KEYS[1])", 1, key))
+
+
+def map_in_site_threads(func, items, max_workers, wait=True, finalize=None):
+	"""Call `func` for every item of `items` using up to `max_workers` threads.
+	Each thread makes its own connection to the current site, so `func` must commit its own work.
+	`finalize` is called in each thread after it runs out of items.
+	Returns the started threads if `wait` is False.
+	"""
+	site = frappe.local.site
+	sites_path = frappe.local.sites_path
+	user = frappe.session.user
+
+	work_queue = queue.SimpleQueue()
+	for item in items:
+		work_queue.put(item)
+
+	def worker():
+		frappe.init(site=site, sites_path=sites_path)
+		try:
+			frappe.connect()
+			frappe.set_user(user)
+
+			while True:
+				try:
+					item = work_queue.get_nowait()
+				except queue.Empty:
+					break
+
+				try:
+					func(item)
+				except Exception:
+					frappe.db.rollback()
+					frappe.log_error(title="Error in background thread", message=frappe.get_traceback())
+
+			if finalize:
+				finalize()
+		finally:
+			frappe.destroy()
+
+	threads = [threading.Thread(target=worker, daemon=True) for i in range(min(max_workers, len(items)))]
+	for thread in threads:
+		thread.start()
+
+	if not wait:
+		return threads
+
+	for thread in threads:
+		thread.join()
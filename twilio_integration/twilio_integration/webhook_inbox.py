@@ -0,0 +1,189 @@
+import frappe
+from frappe.utils import cint, now_datetime, add_to_date
+import json
+
+
+WEBHOOK_BATCH_SIZE = 100
+MAX_WEBHOOK_BATCHES = 10
+PROCESSING_TIMEOUT_MINUTES = 10
+PROCESSING_ENQUEUED_KEY = "twilio_webhook_inbox_enqueued"
+
+webhook_handlers = {
+	"WhatsApp Message Status": "twilio_integration.twilio_integration.api.process_whatsapp_message_status_webhook",
+	"Incoming WhatsApp Message": "twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message.process_incoming_message",
+	"Voice Call": "twilio_integration.twilio_integration.api.process_voice_call_webhook",
+	"Incoming Call": "twilio_integration.twilio_integration.api.process_incoming_call_webhook",
+	"Recording Info": "twilio_integration.twilio_integration.api.process_recording_info_webhook",
+}
+
+
+def is_webhook_inbox_enabled():
+	return cint(frappe.get_cached_value("Twilio Settings", None, "use_webhook_inbox"))
+
+
+def store_webhook_request(webhook, payload):
+	"""Store the raw webhook payload with a single insert and trigger processing"""
+	now = now_datetime()
+	frappe.db.bulk_insert(
+		"Twilio Webhook Request",
+		fields=["name", "creation", "modified", "owner", "modified_by", "docstatus", "webhook", "status", "payload"],
+		values=[(
+			frappe.generate_hash(length=10), now, now, frappe.session.user, frappe.session.user, 0,
+			webhook, "Pending", json.dumps(payload),
+		)],
+	)
+	frappe.db.commit()
+
+	enqueue_webhook_inbox_processing()
+
+
+def enqueue_webhook_inbox_processing():
+	"""Enqueue processing of the inbox unless a job is already waiting to be picked"""
+	key = frappe.cache().make_key(PROCESSING_ENQUEUED_KEY)
+	if frappe.cache().set(key, 1, nx=True, ex=60):
+		frappe.enqueue(
+			"twilio_integration.twilio_integration.webhook_inbox.process_webhook_inbox",
+			queue="short",
+		)
+
+
+def process_webhook_inbox():
+	"""Process pending webhook requests in batches, in the order they were received"""
+	frappe.cache().delete_value(PROCESSING_ENQUEUED_KEY)
+	frappe.set_user("Administrator")
+
+	recover_stuck_webhook_requests()
+
+	for i in range(MAX_WEBHOOK_BATCHES):
+		webhook_requests = claim_webhook_requests(WEBHOOK_BATCH_SIZE)
+		if not webhook_requests:
+			break
+
+		process_webhook_requests(webhook_requests)
+
+
+def claim_webhook_requests(limit):
+	webhook_requests = frappe.db.sql("""
+		select name, webhook, payload
+		from `tabTwilio Webhook Request`
+		where status = 'Pending'
+		order by creation
+		limit %s
+		for update skip locked
+	""", limit, as_dict=1)
+
+	if webhook_requests:
+		frappe.db.sql("""
+			update `tabTwilio Webhook Request`
+			set status = 'Processing', modified = %s
+			where name in %s
+		""", (now_datetime(), [d.name for d in webhook_requests]))
+
+	frappe.db.commit()
+	return webhook_requests
+
+
+def process_webhook_requests(webhook_requests):
+	"""Apply message status requests of the batch together, other requests one by one in the order they were received.
+	Processed requests are marked with a single update for the batch.
+	"""
+	status_requests = [d for d in webhook_requests if d.webhook == "WhatsApp Message Status"]
+	other_requests = [d for d in webhook_requests if d.webhook != "WhatsApp Message Status"]
+
+	processed = []
+	if status_requests:
+		if apply_status_webhook_requests(status_requests):
+			processed += [d.name for d in status_requests]
+		else:
+			# Find the failing requests by processing them one by one
+			other_requests = status_requests + other_requests
+
+	for webhook_request in other_requests:
+		if process_webhook_request(webhook_request):
+			processed.append(webhook_request.name)
+
+	if processed:
+		frappe.db.sql("""
+			update `tabTwilio Webhook Request`
+			set status = 'Processed', processed_at = %s, error = null
+			where name in %s
+		""", (now_datetime(), processed))
+		frappe.db.commit()
+
+
+def apply_status_webhook_requests(webhook_requests):
+	from twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message import (
+		apply_status_updates,
+		get_twilio_status_update,
+	)
+
+	try:
+		status_updates = []
+		for webhook_request in webhook_requests:
+			status_update = get_twilio_status_update(frappe._dict(json.loads(webhook_request.payload)))
+			if status_update:
+				status_updates.append(status_update)
+
+		if status_updates:
+			apply_status_updates(status_updates, auto_commit=True, buffer_missing=True)
+	except Exception:
+		frappe.db.rollback()
+		return False
+
+	return True
+
+
+def process_webhook_request(webhook_request):
+	"""Process a single request, returns True if it was processed. Failed requests are marked as Error."""
+	try:
+		handler = frappe.get_attr(webhook_handlers[webhook_request.webhook])
+		handler(frappe._dict(json.loads(webhook_request.payload)))
+	except Exception:
+		frappe.db.rollback()
+		frappe.db.set_value("Twilio Webhook Request", webhook_request.name, {
+			"status": "Error",
+			"error": frappe.get_traceback(),
+		}, update_modified=False)
+		frappe.db.commit()
+		return False
+
+	return True
+
+
+def recover_stuck_webhook_requests():
+	"""Return requests claimed by a worker that did not finish processing them to the inbox"""
+	frappe.db.sql("""
+		update `tabTwilio Webhook Request`
+		set status = 'Pending'
+		where status = 'Processing' and modified < %s
+	""", add_to_date(now_datetime(), minutes=-PROCESSING_TIMEOUT_MINUTES))
+	frappe.db.commit()
+
+
+@frappe.whitelist()
+def replay_webhook_requests(names):
+	"""Process stored webhook requests again"""
+	frappe.only_for("System Manager")
+
+	if isinstance(names, str):
+		names = json.loads(names)
+	if not names:
+		return
+
+	frappe.db.sql("""
+		update `tabTwilio Webhook Request`
+		set status = 'Pending', modified = %s
+		where name in %s and status in ('Processed', 'Error')
+	""", (now_datetime(), names))
+	frappe.db.commit()
+
+	enqueue_webhook_inbox_processing()
+
+
+def clear_processed_webhook_requests():
+	retention_days = cint(frappe.get_cached_value("Twilio Settings", None, "webhook_retention_days")) or 7
+	frappe.db.delete("Twilio Webhook Request", {
+		"status": "Processed",
+		"creation": ("<", add_to_date(now_datetime(), days=-retention_days)),
+	})
+	frappe.db.commit()
@@ -0,0 +1,107 @@
+import frappe
+from frappe.utils import cint
+import sys
+import time
+
+
+DISPATCH_QUEUE = "whatsapp_dispatch_queue"
+DISPATCH_BATCH_SIZE = 100
+# Lua's unpack fails with too many values, so large pushes are split
+PUSH_CHUNK_SIZE = 1000
+MAX_RECONNECT_BACKOFF_SECONDS = 5 * 60
+
+# Pop up to ARGV[1] items from the head of the list
+pop_items_script = """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+redis.call('LTRIM', KEYS[1], #items, -1)
+return items
+"""
+
+
+def is_dispatcher_worker_enabled():
+	return cint(frappe.get_cached_value("WhatsApp Settings", None, "use_dispatcher_worker"))
+
+
+def push_to_dispatch_queue(message_names):
+	"""Push message names to the dispatcher worker once the current transaction is committed"""
+	if not message_names:
+		return
+
+	def push():
+		key = get_dispatch_queue_key()
+		for i in range(0, len(message_names), PUSH_CHUNK_SIZE):
+			frappe.cache().eval(
+				"return redis.call('RPUSH', KEYS[1], unpack(ARGV))", 1, key, *message_names[i:i + PUSH_CHUNK_SIZE]
+			)
+
+	frappe.db.after_commit.add(push)
+
+
+def pop_from_dispatch_queue(timeout):
+	"""Wait for upto `timeout` seconds for pushed message names and return a batch of them"""
+	key = get_dispatch_queue_key()
+
+	item = frappe.cache().blpop([key], timeout=timeout)
+	if not item:
+		return []
+
+	message_names = [item[1]] + frappe.cache().eval(pop_items_script, 1, key, DISPATCH_BATCH_SIZE - 1)
+	return [frappe.safe_decode(d) for d in message_names]
+
+
+def get_dispatch_queue_key():
+	return frappe.cache().make_key(DISPATCH_QUEUE)
+
+
+def run_dispatcher_worker(site, poll_timeout=5):
+	"""Send outgoing messages as soon as they are pushed to the dispatch queue.
+	Messages that are not pushed are still sent by the scheduled flush of the outgoing queue.
+	"""
+	from twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message import (
+		are_whatsapp_messages_muted,
+		send_whatsapp_messages,
+	)
+
+	failures = 0
+	while True:
+		# Connect for each batch so that settings and caches do not go stale in the long running process
+		frappe.init(site=site)
+		try:
+			frappe.connect()
+			frappe.set_user("Administrator")
+
+			message_names = pop_from_dispatch_queue(poll_timeout)
+			if message_names:
+				if are_whatsapp_messages_muted():
+					# Left in the table for the scheduled flush
+					time.sleep(poll_timeout)
+				else:
+					send_whatsapp_messages(message_names)
+
+			failures = 0
+
+		except Exception:
+			failures += 1
+			log_dispatcher_error()
+
+			# Back off while the database or Redis is unavailable
+			time.sleep(min(poll_timeout * 2 ** (failures - 1), MAX_RECONNECT_BACKOFF_SECONDS))
+
+		finally:
+			frappe.destroy()
+
+
+def log_dispatcher_error():
+	traceback = frappe.get_traceback()
+
+	# The error may be that the database could not be connected to
+	if not getattr(frappe.local, "db", None):
+		print(traceback, file=sys.stderr)
+		return
+
+	try:
+		frappe.db.rollback()
+		frappe.log_error(title="WhatsApp Dispatcher Error", message=traceback)
+		frappe.db.commit()
+	except Exception:
+		print(traceback, file=sys.stderr)